@@ -0,0 +1,3 @@
+"""
+Benchmarks of SNOW. Run them from `src`, e.g. `python -m bench.event_parse`.
+"""
@@ -0,0 +1,89 @@
+"""
+Compare the time to parse events' start/end with `parse_time` against the
+plain dateutil parsing that SNOW used before.
+
+    python -m bench.event_parse [--num_events 100000]
+"""
+import argparse
+import datetime
+import random
+import time
+from typing import Callable, Dict, List
+
+import dateutil.parser
+import dateutil.tz
+
+from service.gcal.event import Event, parse_time
+
+
+def make_events(num_events: int, seed: int = 0) -> List[Dict]:
+    """Generate event resources in the shapes Google returns them."""
+    rand = random.Random(seed)
+    tz_names = ["America/New_York", "Europe/London", "Asia/Shanghai", "UTC"]
+    events = []
+    for i in range(num_events):
+        start = datetime.datetime(2020, 1, 1) + datetime.timedelta(
+            minutes=30 * rand.randrange(0, 100000))
+        end = start + datetime.timedelta(minutes=30 * rand.randrange(1, 8))
+        kind = i % 4
+        if kind == 0:  # with the offset of the calendar's timezone
+            fmt = lambda t: {"dateTime": t.isoformat() + "-05:00",
+                             "timeZone": "America/New_York"}
+        elif kind == 1:  # in UTC
+            fmt = lambda t: {"dateTime": t.isoformat() + "Z"}
+        elif kind == 2:  # with an explicit timezone but no offset
+            tz_name = rand.choice(tz_names)
+            fmt = lambda t: {"dateTime": t.isoformat(), "timeZone": tz_name}
+        else:  # all-day
+            fmt = lambda t: {"date": t.date().isoformat()}
+        events.append({"id": f"e{i}", "status": "confirmed",
+                       "kind": "calendar#event", "summary": f"Event {i}",
+                       "start": fmt(start), "end": fmt(end)})
+    return events
+
+
+def parse_time_dateutil(data: Dict):
+    """How SNOW parsed the start/end before: dateutil for every timestamp."""
+    if 'dateTime' in data:
+        dt = dateutil.parser.isoparse(data['dateTime'])
+        if dt.tzinfo is None and 'timeZone' in data:
+            dt = dt.replace(tzinfo=dateutil.tz.gettz(data['timeZone']))
+        return dt, False
+    return datetime.date.fromisoformat(data['date']), True
+
+
+def run(name: str, fn: Callable[[Dict], None], events: List[Dict]) -> float:
+    begin = time.perf_counter()
+    for data in events:
+        fn(data)
+    elapsed = time.perf_counter() - begin
+    print(f"{name:<24} {elapsed:8.3f}s {len(events) / elapsed:12,.0f} events/s")
+    return elapsed
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(
+        description="Benchmark parsing the start/end of events.")
+    arg_parser.add_argument("--num_events", type=int, default=100000)
+    args = arg_parser.parse_args()
+
+    events = make_events(args.num_events)
+    for data in events:  # both must agree
+        assert parse_time(data["start"]) == parse_time_dateutil(data["start"])
+
+    def parse_dateutil(data: Dict) -> None:
+        parse_time_dateutil(data["start"])
+        parse_time_dateutil(data["end"])
+
+    def parse_fast(data: Dict) -> None:
+        parse_time(data["start"])
+        parse_time(data["end"])
+
+    baseline = run("dateutil", parse_dateutil, events)
+    fast = run("parse_time", parse_fast, events)
+    run("Event (parse_time)", Event, events)
+    print(f"speedup of parse_time: {baseline / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,539 @@
+"""
+Local stand-ins of the Google Calendar and Notion endpoints that SNOW uses,
+so that its throughput could be measured without real accounts.
+
+Only what SNOW sends is served:
+- Google: calendarList.list, events.list (with paging and sync tokens) and
+  events.get, also in batch requests (multipart/mixed);
+- Notion: search, databases.retrieve, databases.query (filtering by text
+  properties with `equals` or `starts_with`, and by created_time only),
+  pages.create and pages.update.
+Besides, `/_bench/<command>` (e.g. `stats`) controls a server; these requests
+are not counted.
+
+The servers run in their own process (see `run_servers`), so that they don't
+add to the memory footprint of the SNOW process being measured.
+"""
+import datetime
+import email.parser
+import json
+import multiprocessing.connection
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+class FakeServer:
+    """
+    A threaded HTTP server with keep-alive connections, an artificial latency
+    per request and counters of requests per endpoint.
+    Subclasses list their endpoints in ROUTES; a handler is called with the
+    groups of the path pattern, and returns (status, body, headers). The body
+    of a request is decoded from JSON, or given as a MIME message (a str with
+    its Content-Type header) if it is multipart; the body of a response is
+    encoded to JSON unless it is bytes already.
+    """
+    # (method, compiled path pattern, handler name)
+    ROUTES = []
+
+    def __init__(self, *, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       name=type(self).__name__, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeServer':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def reset_counts(self) -> Counter:
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counts[name] += 1
+
+    def control(self, command: str, body: Optional[Dict]) -> Optional[Dict]:
+        """Serve `/_bench/<command>`; return None if it is unknown."""
+        if command == "stats":
+            with self.lock:
+                return {"counts": dict(self.counts)}
+        if command == "reset":
+            return {"counts": dict(self.reset_counts())}
+        return None
+
+    def route(self, method: str, path: str, query: Dict[str, str],
+              body: Optional[Dict],
+              delay: bool = True) -> Tuple[int, Dict, Dict[str, str]]:
+        """Serve a request; `delay` is False for requests in a batch."""
+        for route_method, pattern, name in self.ROUTES:
+            if route_method != method:
+                continue
+            m = pattern.fullmatch(path)
+            if m is None:
+                continue
+            self.count(name)
+            if delay and self.latency > 0:
+                time.sleep(self.latency)
+            return getattr(self, name)(*map(unquote, m.groups()),
+                                       query=query, body=body)
+        return 404, {"error": f"{method} {path} not found"}, {}
+
+    def make_handler(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep connections alive, as the real servers do
+            protocol_version = "HTTP/1.1"
+            # otherwise, the body (sent after the headers) may wait for the
+            # delayed ACK of the client on a kept-alive connection
+            disable_nagle_algorithm = True
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def serve(self) -> None:
+                url = urlsplit(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else None
+                content_type = self.headers.get("Content-Type", "")
+                if body is None:
+                    pass
+                elif content_type.startswith("multipart/"):
+                    body = f"Content-Type: {content_type}\r\n\r\n" \
+                        + body.decode("utf-8")
+                else:
+                    body = json.loads(body)
+                res = None
+                if url.path.startswith("/_bench/"):
+                    res = server.control(url.path[len("/_bench/"):], body)
+                if res is not None:
+                    status, headers = 200, {}
+                else:
+                    status, res, headers = server.route(self.command,
+                                                        url.path, query, body)
+                data = res if isinstance(res, bytes) \
+                    else json.dumps(res).encode("utf-8")
+                self.send_response(status)
+                if "Content-Type" not in headers:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = serve
+
+        return Handler
+
+
+class FakeGoogleCalendar(FakeServer):
+    """
+    Calendars of generated events. Every change bumps a global version; a sync
+    token is the version it was issued at, so listing with it returns the
+    events changed since then (including cancelled ones).
+    """
+    API_PATH = "/calendar/v3/"
+    ROUTES = [
+        ("GET", re.compile(r"/calendar/v3/users/me/calendarList"),
+         "list_calendars"),
+        ("GET", re.compile(r"/calendar/v3/calendars/([^/]+)/events"),
+         "list_events"),
+        ("GET", re.compile(r"/calendar/v3/calendars/([^/]+)/events/([^/]+)"),
+         "get_event"),
+        ("POST", re.compile(r"/batch/calendar/v3"), "batch"),
+    ]
+
+    def __init__(self,
+                 *,
+                 num_calendars: int = 1,
+                 num_events: int = 1000,
+                 latency: float = 0.0,
+                 event_latency: float = 0.0,
+                 seed: int = 0) -> None:
+        super().__init__(latency=latency)
+        # extra latency of a listing per event in it
+        self.event_latency = event_latency
+        self.rand = random.Random(seed)
+        self.version = 0
+        # sync tokens older than this are expired
+        self.min_sync_version = 0
+        self.num_events_listed = 0
+        # calendar id -> (summary, event id -> (version, event resource))
+        self.calendars = OrderedDict()
+        for c in range(num_calendars):
+            events = OrderedDict()
+            self.calendars[f"cal{c}@bench"] = (f"Calendar {c}", events)
+            for _ in range(num_events):
+                self.put_event(events, self.make_event())
+
+    @property
+    def api_endpoint(self) -> str:
+        return self.url + self.API_PATH
+
+    @property
+    def calendar_names(self) -> List[str]:
+        return [summary for summary, _ in self.calendars.values()]
+
+    def make_event(self, event_id: Optional[str] = None) -> Dict:
+        # spread over the years since the `time_min` of the benchmark, so
+        # that time windows of a listing have about as many events each
+        start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc) \
+            + datetime.timedelta(minutes=30 * self.rand.randrange(0, 120000))
+        end = start + datetime.timedelta(minutes=30 * self.rand.randrange(1, 8))
+        return {
+            "kind": "calendar#event",
+            "id": event_id or uuid.UUID(int=self.rand.getrandbits(128)).hex,
+            "status": "confirmed",
+            "summary": f"Event {self.rand.randrange(1 << 30)}",
+            "location": f"Room {self.rand.randrange(100)}",
+            "description": "Generated by SNOW's benchmark",
+            "start": {"dateTime": start.isoformat().replace("+00:00", "Z")},
+            "end": {"dateTime": end.isoformat().replace("+00:00", "Z")},
+        }
+
+    def put_event(self, events: OrderedDict, event: Dict) -> None:
+        with self.lock:
+            self.version += 1
+            events[event["id"]] = (self.version, event)
+            events.move_to_end(event["id"])
+
+    def mutate(self, num_changes: int, num_moved: int = 0,
+               num_purged: int = 0) -> None:
+        """
+        Update, cancel and add (one third each) events of every calendar.
+        Besides, move `num_moved` events to 2019 (before any `time_min` of
+        the benchmark, so a full listing misses them), and purge `num_purged`
+        events (which leaves no cancelled event to list, as Google does some
+        time after the cancellation).
+        """
+        for _, events in self.calendars.values():
+            live = [eid for eid, (_, e) in events.items()
+                    if e["status"] != "cancelled"]
+            num_updated = min(len(live), num_changes * 2 // 3)
+            sampled = self.rand.sample(
+                live, min(len(live), num_updated + num_moved + num_purged))
+            for i, eid in enumerate(sampled[:num_updated]):
+                if i % 2 == 0:
+                    event = self.make_event(eid)
+                else:
+                    event = {"kind": "calendar#event", "id": eid,
+                             "status": "cancelled"}
+                self.put_event(events, event)
+            for _ in range(num_changes - num_changes * 2 // 3):
+                self.put_event(events, self.make_event())
+            moved = sampled[num_updated:num_updated + num_moved]
+            for eid in moved:
+                event = self.make_event(eid)
+                for key in ("start", "end"):
+                    event[key]["dateTime"] = "2019" + event[key]["dateTime"][4:]
+                self.put_event(events, event)
+            with self.lock:
+                for eid in sampled[num_updated + len(moved):]:
+                    del events[eid]
+
+    def control(self, command: str, body: Optional[Dict]) -> Optional[Dict]:
+        if command == "mutate":
+            self.mutate(body["num_changes"], body.get("num_moved", 0),
+                        body.get("num_purged", 0))
+            return {}
+        if command == "expire_sync_tokens":
+            with self.lock:
+                self.min_sync_version = self.version + 1
+            return {}
+        res = super().control(command, body)
+        if res is not None:
+            with self.lock:
+                res["num_events_listed"] = self.num_events_listed
+                if command == "reset":
+                    self.num_events_listed = 0
+        return res
+
+    def list_calendars(self, *, query: Dict[str, str], body: Optional[Dict]):
+        items = [{"kind": "calendar#calendarListEntry", "id": cal_id,
+                  "summary": summary}
+                 for cal_id, (summary, _) in self.calendars.items()]
+        return self.paginate(items, query)
+
+    def list_events(self, cal_id: str, *, query: Dict[str, str],
+                    body: Optional[Dict]):
+        if cal_id not in self.calendars:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}, {}
+        _, events = self.calendars[cal_id]
+        since = 0
+        if "syncToken" in query:
+            since = int(query["syncToken"])
+            if not self.min_sync_version <= since <= self.version:
+                return 410, {"error": {"code": 410, "message": "Gone"}}, {}
+        # like Google, a full listing only has cancelled events if asked
+        show_deleted = since > 0 or query.get("showDeleted") == "true"
+        # events that end after timeMin and start before timeMax
+        time_min = self.parse_time(query.get("timeMin"))
+        time_max = self.parse_time(query.get("timeMax"))
+        with self.lock:
+            version = self.version
+            items = [e for v, e in events.values() if v > since
+                     and (show_deleted or e["status"] != "cancelled")
+                     and (time_min is None or "end" not in e or
+                          self.parse_time(e["end"]["dateTime"]) > time_min)
+                     and (time_max is None or "start" not in e or
+                          self.parse_time(e["start"]["dateTime"]) < time_max)]
+        status, res, headers = self.paginate(items, query)
+        if "nextPageToken" not in res:
+            res["nextSyncToken"] = str(version)
+        # Google goes through the events of a page even if none is returned
+        if self.event_latency > 0:
+            time.sleep(self.event_latency * len(res["items"]))
+        if "items" not in query.get("fields", "items"):
+            # e.g. only to get the sync token
+            del res["items"]
+            return status, res, headers
+        with self.lock:
+            self.num_events_listed += len(res["items"])
+        return status, res, headers
+
+    @staticmethod
+    def parse_time(s: Optional[str]) -> Optional[datetime.datetime]:
+        if s is None:
+            return None
+        return datetime.datetime.fromisoformat(s.replace("Z", "+00:00"))
+
+    def get_event(self, cal_id: str, event_id: str, *, query: Dict[str, str],
+                  body: Optional[Dict]):
+        _, events = self.calendars.get(cal_id, (None, {}))
+        if event_id not in events:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}, {}
+        return 200, events[event_id][1], {}
+
+    def batch(self, *, query: Dict[str, str], body: str):
+        """
+        Serve each call in a multipart/mixed batch (without the latency of a
+        request), and answer them in one multipart/mixed response.
+        """
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for part in email.parser.Parser().parsestr(body).get_payload():
+            # e.g. "GET /calendar/v3/calendars/.../events/...?fields=... HTTP/1.1"
+            method, target, _ = part.get_payload().split("\n", 1)[0].split()
+            url = urlsplit(target)
+            status, res, _ = self.route(
+                method, url.path,
+                {k: v[-1] for k, v in parse_qs(url.query).items()}, None,
+                delay=False)
+            # the header may be folded, e.g. "<base +\r\n id>"
+            content_id = re.sub(r"\r?\n", "", part["Content-ID"])
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id[1:]}\r\n\r\n"
+                f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                "Content-Type: application/json\r\n\r\n"
+                f"{json.dumps(res)}\r\n")
+        parts.append(f"--{boundary}--\r\n")
+        return 200, "".join(parts).encode("utf-8"), \
+            {"Content-Type": f"multipart/mixed; boundary={boundary}"}
+
+    @staticmethod
+    def paginate(items: List[Dict], query: Dict[str, str]):
+        offset = int(query.get("pageToken") or 0)
+        size = int(query.get("maxResults") or 250)
+        res = {"items": items[offset:offset + size]}
+        if offset + size < len(items):
+            res["nextPageToken"] = str(offset + size)
+        return 200, res, {}
+
+
+class FakeNotion(FakeServer):
+    """
+    One database of pages. Like Notion, it answers HTTP 429 with a
+    `Retry-After` header if requests come faster than `rate` per second (if
+    given); it also answers 429 at random with probability `error_rate`.
+    """
+    DB_NAME = "SNOW Bench"
+    ROUTES = [
+        ("POST", re.compile(r"/v1/search"), "search"),
+        ("GET", re.compile(r"/v1/databases/([^/]+)"), "retrieve_database"),
+        ("POST", re.compile(r"/v1/databases/([^/]+)/query"), "query_database"),
+        ("POST", re.compile(r"/v1/pages"), "create_page"),
+        ("PATCH", re.compile(r"/v1/pages/([^/]+)"), "update_page"),
+    ]
+
+    def __init__(self,
+                 *,
+                 latency: float = 0.0,
+                 rate: Optional[float] = None,
+                 error_rate: float = 0.0,
+                 retry_after: float = 0.1,
+                 calendar_names: Optional[List[str]] = None,
+                 seed: int = 0) -> None:
+        super().__init__(latency=latency)
+        self.rate = rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rand = random.Random(seed)
+        self.tokens = rate or 0.0
+        self.refilled_at = time.monotonic()
+        self.database = {
+            "object": "database",
+            "id": str(uuid.UUID(int=self.rand.getrandbits(128))),
+            "created_time": "2022-01-01T00:00:00.000Z",
+            "title": [{"type": "text", "plain_text": self.DB_NAME,
+                       "text": {"content": self.DB_NAME}}],
+            "properties": {
+                "Name": {"name": "Name", "type": "title", "title": {}},
+                "Date": {"name": "Date", "type": "date", "date": {}},
+                "Calendar": {"name": "Calendar", "type": "select",
+                             "select": {"options": [
+                                 {"name": n} for n in calendar_names or []]}},
+                "Location": {"name": "Location", "type": "rich_text",
+                             "rich_text": {}},
+                "Description": {"name": "Description", "type": "rich_text",
+                                "rich_text": {}},
+                "Event ID": {"name": "Event ID", "type": "rich_text",
+                             "rich_text": {}},
+            },
+        }
+        self.pages = {}
+
+    def route(self, method: str, path: str, query: Dict[str, str],
+              body: Optional[Dict]) -> Tuple[int, Dict, Dict[str, str]]:
+        if self.is_throttled():
+            self.count("throttled")
+            return 429, {"object": "error", "status": 429,
+                         "code": "rate_limited",
+                         "message": "You have been rate limited."}, \
+                {"Retry-After": str(self.retry_after)}
+        return super().route(method, path, query, body)
+
+    def is_throttled(self) -> bool:
+        with self.lock:
+            if self.error_rate > 0 and self.rand.random() < self.error_rate:
+                return True
+            if self.rate is None:
+                return False
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens
+                              + (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+            return False
+
+    def control(self, command: str, body: Optional[Dict]) -> Optional[Dict]:
+        res = super().control(command, body)
+        if res is not None:
+            with self.lock:
+                res["num_pages"] = sum(not p["archived"]
+                                       for p in self.pages.values())
+        return res
+
+    def search(self, *, query: Dict[str, str], body: Optional[Dict]):
+        return 200, {"object": "list", "results": [self.database],
+                     "has_more": False, "next_cursor": None}, {}
+
+    def retrieve_database(self, db_id: str, *, query: Dict[str, str],
+                          body: Optional[Dict]):
+        if db_id != self.database["id"]:
+            return 404, {"object": "error", "status": 404,
+                         "code": "object_not_found", "message": db_id}, {}
+        return 200, self.database, {}
+
+    @staticmethod
+    def match(page: Dict, filter: Dict) -> bool:
+        if "and" in filter:
+            return all(FakeNotion.match(page, f) for f in filter["and"])
+        if filter.get("timestamp") == "created_time":
+            cond = filter["created_time"]
+            # ISO 8601 strings of the same format compare chronologically
+            created_time = page["created_time"]
+            after = cond.get("on_or_after")
+            return after is None or created_time >= after.replace("+00:00", "Z")
+        prop = page["properties"].get(filter["property"], {})
+        for prop_type in ("title", "rich_text"):
+            if prop_type in filter:
+                text = "".join(t["text"]["content"]
+                               for t in prop.get(prop_type, []))
+                cond = filter[prop_type]
+                if "starts_with" in cond:
+                    return text.startswith(cond["starts_with"])
+                return text == cond["equals"]
+        raise ValueError(f"Unsupported filter: {filter}")
+
+    def query_database(self, db_id: str, *, query: Dict[str, str],
+                       body: Optional[Dict]):
+        if db_id != self.database["id"]:
+            return 404, {"object": "error", "status": 404,
+                         "code": "object_not_found", "message": db_id}, {}
+        body = body or {}
+        with self.lock:
+            pages = [p for p in self.pages.values() if not p["archived"]
+                     and ("filter" not in body or self.match(p, body["filter"]))]
+        offset = int(body.get("start_cursor") or 0)
+        size = int(body.get("page_size") or 100)
+        has_more = offset + size < len(pages)
+        return 200, {"object": "list", "results": pages[offset:offset + size],
+                     "has_more": has_more,
+                     "next_cursor": str(offset + size) if has_more else None}, {}
+
+    def create_page(self, *, query: Dict[str, str], body: Optional[Dict]):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        page = {"object": "page", "id": str(uuid.uuid4()), "archived": False,
+                "created_time": now.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                "parent": body["parent"], "properties": body["properties"]}
+        with self.lock:
+            self.pages[page["id"]] = page
+        return 200, page, {}
+
+    def update_page(self, page_id: str, *, query: Dict[str, str],
+                    body: Optional[Dict]):
+        with self.lock:
+            page = self.pages.get(page_id)
+            if page is None:
+                return 404, {"object": "error", "status": 404,
+                             "code": "object_not_found",
+                             "message": page_id}, {}
+            page["properties"].update(body.get("properties", {}))
+            page["archived"] = body.get("archived", page["archived"])
+        return 200, page, {}
+
+
+def run_servers(conn: multiprocessing.connection.Connection,
+                google_kwargs: Dict[str, Any],
+                notion_kwargs: Dict[str, Any]) -> None:
+    """
+    The entry of the servers' process: start both servers, send back
+    (Google's API endpoint, Notion's base URL, names of calendars), and serve
+    until anything is received from `conn`.
+    """
+    google = FakeGoogleCalendar(**google_kwargs).start()
+    notion = FakeNotion(calendar_names=google.calendar_names,
+                        **notion_kwargs).start()
+    conn.send((google.api_endpoint, notion.url, google.calendar_names))
+    conn.recv()
+    google.stop()
+    notion.stop()
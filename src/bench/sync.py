@@ -0,0 +1,222 @@
+"""
+Measure the throughput of `do_sync` against local stand-ins of Google Calendar
+and Notion (see `bench.servers`): an initial (full) synchronization of
+generated calendars, and then an incremental one after some changes.
+
+    snow bench [--num_events 1000] [--latency 0.05] ...
+
+With `--expire_sync_tokens`, the calendars are then synchronized after some
+more changes and the expiry of their sync tokens.
+
+With `--reconcile`, the local states are then removed, and the calendars are
+reconciled with the pages on Notion after some more changes.
+
+Before either, some events are also moved before `time_min` and some are
+purged (see `--num_unlisted`): a full listing misses both, so they are looked
+up with batch requests; the pages of moved events are kept, and those of
+purged ones are archived.
+
+All states are kept in a temporary SNOW_HOME, so the real one is not touched.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, Optional
+
+from bench.servers import run_servers
+
+
+def call_control(url: str, command: str, body: Optional[Dict] = None) -> Dict:
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    req = urllib.request.Request(f"{url}/_bench/{command}", data=data,
+                                 method="GET" if data is None else "POST")
+    with urllib.request.urlopen(req) as res:
+        return json.load(res)
+
+
+def get_peak_rss_mb() -> float:
+    # in KB on Linux, but in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20 if os.uname().sysname == "Darwin" else 1 << 10)
+
+
+def parse_args() -> Dict[str, Any]:
+    arg_parser = argparse.ArgumentParser(
+        prog="snow bench",
+        description="Benchmark synchronization against local fake servers.")
+    arg_parser.add_argument("--num_calendars", type=int, default=1)
+    arg_parser.add_argument("--num_profiles", type=int, default=0,
+                            help="Split calendars among this many profiles "
+                            "(default: no profiles)")
+    arg_parser.add_argument("--num_events", type=int, default=1000,
+                            help="Number of events per calendar")
+    arg_parser.add_argument("--num_changes", type=int, default=100,
+                            help="Number of events changed per calendar "
+                            "before the incremental synchronization")
+    arg_parser.add_argument("--num_unlisted", type=int, default=5,
+                            help="Number of events moved before time_min, "
+                            "and of events purged, per calendar before the "
+                            "expired and reconcile runs")
+    arg_parser.add_argument("--latency", type=float, default=0.02,
+                            help="Latency of each request in seconds")
+    arg_parser.add_argument("--event_latency", type=float, default=0.0,
+                            help="Extra latency of listing per event listed "
+                            "in seconds")
+    arg_parser.add_argument("--server_rate", type=float, default=None,
+                            help="Requests per second beyond which Notion "
+                            "answers 429 (default: unlimited)")
+    arg_parser.add_argument("--error_rate", type=float, default=0.0,
+                            help="Probability that Notion answers 429")
+    arg_parser.add_argument("--notion_rate", type=float, default=100.0,
+                            help="Requests per second SNOW sends to Notion "
+                            "(the real limit is 3)")
+    arg_parser.add_argument("--workers", type=int, default=4)
+    arg_parser.add_argument("--calendar_workers", type=int, default=1)
+    arg_parser.add_argument("--engine", choices=["thread", "async"],
+                            default="thread")
+    arg_parser.add_argument("--listing_windows", type=int, default=1)
+    arg_parser.add_argument("--preload", action="store_true")
+    arg_parser.add_argument("--expire_sync_tokens", action="store_true",
+                            help="Also measure a synchronization after the "
+                            "sync tokens expire")
+    arg_parser.add_argument("--reconcile", action="store_true",
+                            help="Also measure `--reconcile` after losing "
+                            "the local states")
+    arg_parser.add_argument("--metrics_out", "--metrics-out", metavar="PATH",
+                            help="Write the metrics of SNOW (of both runs) "
+                            "to the given JSON file")
+    return vars(arg_parser.parse_args())
+
+
+def main() -> None:
+    args = parse_args()
+    snow_home = tempfile.mkdtemp(prefix="snow-bench-")
+    # must be set before importing gcal_notion, which reads it
+    os.environ["SNOW_HOME"] = snow_home
+    import gcal_notion as app
+
+    ctx = multiprocessing.get_context("spawn")
+    conn, child_conn = ctx.Pipe()
+    servers = ctx.Process(
+        target=run_servers, daemon=True,
+        args=(child_conn,
+              {"num_calendars": args["num_calendars"],
+               "num_events": args["num_events"],
+               "latency": args["latency"],
+               "event_latency": args["event_latency"]},
+              {"latency": args["latency"], "rate": args["server_rate"],
+               "error_rate": args["error_rate"]}))
+    servers.start()
+    try:
+        google_url, notion_url, cal_names = conn.recv()
+        google_ctl_url = google_url.split("/calendar/v3/")[0]
+
+        os.makedirs(app.DATA_DIR)
+        token_path = os.path.join(app.DATA_DIR, "gcal_token.json")
+        with open(token_path, "w") as f:
+            # a token that never expires, so no refresh is sent
+            json.dump({"token": "bench", "refresh_token": "bench",
+                       "client_id": "bench", "client_secret": "bench",
+                       "expiry": "2999-01-01T00:00:00Z"}, f)
+        notion_token_path = os.path.join(app.DATA_DIR, "notion_token.json")
+        with open(notion_token_path, "w") as f:
+            f.write("bench")
+
+        app.notion.set_rate_limit(rate=args["notion_rate"],
+                                  burst=max(1, int(args["notion_rate"])))
+        if args["engine"] == "thread":
+            app.gcal.set_pool_size((args["listing_windows"] + 1)
+                                   * args["calendar_workers"])
+            app.notion.set_pool_size(args["workers"] * args["calendar_workers"])
+        app.gcal.auth(token_path, token_path, api_endpoint=google_url)
+        app.notion.auth(notion_token_path, base_url=notion_url)
+
+        if args["num_profiles"] > 0:
+            n = args["num_profiles"]
+            app.config.profiles = {
+                f"bench{i}": {"cal_list": ",".join(cal_names[i::n])}
+                for i in range(n)}
+        else:
+            app.config.set_val("cal_list", ",".join(cal_names))
+        app.config.set_val("db_name", "SNOW Bench")
+        app.config.set_val("time_min", "2020-01-01")
+        app.config.set_val("field_col_map",
+                           "cal_name:Calendar,title:Name,time:Date,"
+                           "location:Location,description:Description")
+        if args["reconcile"]:
+            app.config.set_val("event_id_col", "Event ID")
+        configs = [app.config]
+        if args["num_profiles"] > 0:
+            configs = [app.get_profile_config(p)
+                       for p in app.config.get_profiles()]
+        call_control(google_ctl_url, "reset")
+        call_control(notion_url, "reset")
+
+        print(f"{'run':<12} {'events':>8} {'time':>8} {'events/s':>10} "
+              f"{'gcal/ev':>8} {'notion/ev':>10} {'429s':>6}")
+        runs = ["initial", "incremental"]
+        if args["expire_sync_tokens"]:
+            runs.append("expired")
+        if args["reconcile"]:
+            runs.append("reconcile")
+        for run in runs:
+            if run != "initial":
+                num_unlisted = 0 if run == "incremental" \
+                    else args["num_unlisted"]
+                call_control(google_ctl_url, "mutate",
+                             {"num_changes": args["num_changes"],
+                              "num_moved": num_unlisted,
+                              "num_purged": num_unlisted})
+            if run == "expired":
+                call_control(google_ctl_url, "expire_sync_tokens")
+            begin = time.perf_counter()
+            if run == "reconcile":
+                for c in configs:
+                    path = app.get_durable_map_path(c)
+                    for suffix in ["", "-wal", "-shm"]:
+                        if os.path.exists(path + suffix):
+                            os.remove(path + suffix)
+                app.do_reconcile(configs,
+                                 num_workers=args["workers"],
+                                 num_cal_workers=args["calendar_workers"],
+                                 num_windows=args["listing_windows"])
+            elif args["engine"] == "async":
+                import asyncio
+                asyncio.run(app.do_sync_async(
+                    configs, preload=args["preload"],
+                    num_windows=args["listing_windows"]))
+            else:
+                app.do_sync(configs,
+                            num_workers=args["workers"],
+                            num_cal_workers=args["calendar_workers"],
+                            preload=args["preload"],
+                            num_windows=args["listing_windows"])
+            elapsed = time.perf_counter() - begin
+            google_stats = call_control(google_ctl_url, "reset")
+            notion_stats = call_control(notion_url, "reset")
+            num_events = max(google_stats["num_events_listed"], 1)
+            num_throttled = notion_stats["counts"].pop("throttled", 0)
+            print(f"{run:<12} {num_events:>8} {elapsed:>7.2f}s "
+                  f"{num_events / elapsed:>10.1f} "
+                  f"{sum(google_stats['counts'].values()) / num_events:>8.3f} "
+                  f"{sum(notion_stats['counts'].values()) / num_events:>10.3f} "
+                  f"{num_throttled:>6}")
+        print(f"pages on Notion: {notion_stats['num_pages']}; "
+              f"peak RSS: {get_peak_rss_mb():.1f} MB")
+        if args["metrics_out"] is not None:
+            from local.metrics import metrics
+            metrics.dump(args["metrics_out"])
+    finally:
+        conn.send("stop")
+        servers.join()
+        shutil.rmtree(snow_home, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,94 @@
+import time
+# measure the startup time (from here until the synchronization begins)
+START_TIME = time.perf_counter()
+
 import os
 import sys
+import functools
 import shutil
 import argparse
 import datetime
 import pprint
 import logging
 import hashlib
-from collections import OrderedDict
-from typing import Dict, List, Tuple
+import re
+import json
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 from service.gcal import GoogleCalendarService
-from service.gcal.calendar import Calendar
+from service.gcal.calendar import Calendar, EventsPage
+from service.gcal.event import Event
 from service.notion import NotionService
 from service.notion.database import Column, Database
-from service.notion.page import PageBuilder
+from service.notion.page import Page, PageBuilder, get_prop_value
+from service.notion.writer import PageWrite, PageWriter
 from local.config import Config
-from local.data import DurableMap
+from local.data import CachedMap, DurableMap, DurableStore
+from local.journal import Journal
+from local.trigger import TriggerServer, send_trigger
+from local.metrics import metrics
 
 DATA_DIR = os.path.join(os.environ['SNOW_HOME'], 'data', 'gcal_notion')
 CACHED_CONFIG_FILE = os.path.join(DATA_DIR, 'config.json')
 CACHED_GCAL_CREDS_PATH = os.path.join(DATA_DIR, 'gcal_creds.json')
 CACHED_GCAL_TOKEN_PATH = os.path.join(DATA_DIR, 'gcal_token.json')
 CACHED_NOTION_TOKEN_PATH = os.path.join(DATA_DIR, 'notion_token.json')
+# shared by all SNOW applications, so not in DATA_DIR
+CACHED_GCAL_DISCOVERY_PATH = os.path.join(os.environ['SNOW_HOME'], 'data',
+                                          'gcal_discovery.json')
 
 DURABLE_MAP_PATH = os.path.join(DATA_DIR, 'gcal_notion.db')
+# where a daemon listens for requests to synchronize now
+DAEMON_SOCKET_PATH = os.path.join(DATA_DIR, 'snow.sock')
+# a daemon refreshes the Google token if it would expire within this long
+# after the next synchronization
+TOKEN_REFRESH_MARGIN_SEC = 300
+
+# imports, config loading and authentications should fit in it; asking the
+# config interactively is not checked against it
+STARTUP_BUDGET_SEC = 1.0
+
+# entries of the services (authenticated once), shared by all profiles
+SHARED_ENTRIES = {"gcal_creds_path", "gcal_token_path", "notion_token_path"}
 
 gcal = GoogleCalendarService()
 notion = NotionService()
+# database id -> database retrieved (and validated) by this process
+validated_dbs = {}
 
 
-def get_gcal_cal_name_list() -> List[str]:
+def get_gcal() -> GoogleCalendarService:
     if not gcal.is_auth:
-        gcal.auth(config.get_parsed_val('gcal_creds_path'),
-                  config.get_parsed_val('gcal_token_path'))
-    return gcal.list_calendars_name()
+        with metrics.phase("auth"):
+            gcal.auth(config.get_parsed_val('gcal_creds_path'),
+                      config.get_parsed_val('gcal_token_path'),
+                      CACHED_GCAL_DISCOVERY_PATH)
+    return gcal
 
 
-def get_notion_db_name_list() -> List[str]:
+def get_notion() -> NotionService:
     if not notion.is_auth:
-        notion.auth(config.get_parsed_val('notion_token_path'))
-    return notion.list_databases_name()
+        with metrics.phase("auth"):
+            notion.auth(config.get_parsed_val('notion_token_path'))
+    return notion
 
 
-def get_notion_active_db() -> Database:
-    if not notion.is_auth:
-        notion.auth(config.get_parsed_val('notion_token_path'))
-    if notion.active_db is None:
-        # force config to set active db through parser `set_active_db`
-        config.get_parsed_val("db_name")
-    return notion.active_db
+def get_gcal_cal_name_list() -> List[str]:
+    return get_gcal().list_calendars_name()
+
+
+def get_notion_db_name_list() -> List[str]:
+    return get_notion().list_databases_name()
+
+
+def get_notion_active_db(config: Config) -> Database:
+    get_notion()
+    return config.get_parsed_val("db_name")
 
 
-def get_notion_db_col_list() -> List[Column]:
-    return get_notion_active_db().get_columns()
+def get_notion_db_col_list(config: Config) -> List[Column]:
+    return get_notion_active_db(config).get_columns()
 
 
 def check_file_exist(file_path: str) -> str:
@@ -60,7 +97,14 @@ def check_file_exist(file_path: str) -> str:
     return file_path
 
 
-def parse_cal_list(cal_list_str: str) -> List[Calendar]:
+def parse_cal_list(config: Config, cal_list_str: str) -> List[Calendar]:
+    # calendars resolved by a previous run are built from their IDs directly,
+    # without listing all calendars of the user
+    resolved = config.get_resolved("cal_list", cal_list_str)
+    if resolved is not None:
+        return [get_gcal().get_calendar_by_id(cal_id, cal_name)
+                for cal_name, cal_id in resolved]
+
     valid_cal_name_list = get_gcal_cal_name_list()
     cal_list = []
     for cal_name in cal_list_str.split(','):
@@ -69,22 +113,40 @@ def parse_cal_list(cal_list_str: str) -> List[Calendar]:
             raise ValueError(f"Calendar {cal_name} not found")
         else:
             cal_list.append(gcal.get_calendar(cal_name))
+    config.set_resolved("cal_list", cal_list_str,
+                        [(cal.name, cal.id) for cal in cal_list])
     return cal_list
 
 
-def set_active_db(db_name: str) -> None:
+def parse_db_name(config: Config, db_name: str) -> Database:
+    # a database resolved by a previous run only needs one request to
+    # revalidate, instead of searching through the whole workspace
+    db_id = config.get_resolved("db_name", db_name)
+    if db_id is not None:
+        # profiles on the same database share one
+        db = validated_dbs.get(db_id)
+        if db is None:
+            db = get_notion().get_database_by_id(db_id)
+        if db is not None and db.name == db_name:
+            validated_dbs[db_id] = db
+            return db
+        logging.info(f"Database {db_name} ({db_id}) has been removed or "
+                     "renamed; will search it again")
+
     if db_name not in get_notion_db_name_list():
         raise ValueError(f"Database {db_name} not found")
-    notion.use_database(db_name)
+    db = notion.get_database(db_name)
+    config.set_resolved("db_name", db_name, db.id)
+    return db
 
 
 def parse_datetime(datetime_str: str) -> datetime.datetime:
     return datetime.datetime.fromisoformat(datetime_str).astimezone()
 
 
-def parse_field_col_map(map_str: str) -> Dict[str, Column]:
+def parse_field_col_map(config: Config, map_str: str) -> Dict[str, Column]:
     valid_field_list = GoogleCalendarService.FIELDS
-    db = get_notion_active_db()
+    db = get_notion_active_db(config)
     field_col_map = OrderedDict()
     for m in map_str.split(','):
         field, col_name = m.split(':', 1)
@@ -107,11 +169,13 @@ def parse_cal_merge(merge_str: str) -> Dict[str, str]:
     return cal_merge_map
 
 
-def parse_col_const(col_str) -> List[Tuple[Column, str]]:
-    db = get_notion_active_db()
+def parse_col_const(config: Config, col_str) -> List[Tuple[Column, str]]:
     # this is not implemented as a Dict but a List, because there is no
     # key-value lookup operation
     col_const_list = []
+    if col_str is None:  # it is okay to have no constant column
+        return col_const_list
+    db = get_notion_active_db(config)
     for c in col_str.split(','):
         col_name, const = c.split('=', 1)
         col = db.get_column(col_name)
@@ -121,8 +185,25 @@ def parse_col_const(col_str) -> List[Tuple[Column, str]]:
     return col_const_list
 
 
-def get_config() -> Config:
-    config = Config()
+def parse_event_id_col(config: Config,
+                       col_name: Optional[str]) -> Optional[Column]:
+    if col_name is None:  # it is okay not to keep event IDs on Notion
+        return None
+    col = get_notion_active_db(config).get_column(col_name)
+    if col is None:
+        raise ValueError(f"Database column {col_name} not found")
+    if col.type != "rich_text":
+        raise ValueError(f"Database column {col_name} is not of type text")
+    return col
+
+
+def get_config(profile: Optional[str] = None) -> Config:
+    """
+    Return the configuration entries of a pipeline (of the given profile, if
+    any); parsers that depend on other entries (e.g. columns on the database)
+    read them from the same configuration.
+    """
+    config = Config(profile)
     config.add("gcal_creds_path",
                "Path to the Google credentials JSON file",
                default=CACHED_GCAL_CREDS_PATH,
@@ -142,12 +223,12 @@ def get_config() -> Config:
         "cal_list",
         "Calendar(s) to synchronize [cal1,cal2,...]",
         hinter=lambda: f"Valid calendars: {list(get_gcal_cal_name_list())}",
-        parser=parse_cal_list)
+        parser=functools.partial(parse_cal_list, config))
     config.add(
         "db_name",
         "Database to which calendars are synchronized",
         hinter=lambda: f"Valid databases: {list(get_notion_db_name_list())}",
-        parser=set_active_db)
+        parser=functools.partial(parse_db_name, config))
     config.add("time_min",
                "Date from which start synchronize: [YYYY-MM-DD]",
                default=datetime.date.today().isoformat(),
@@ -157,30 +238,108 @@ def get_config() -> Config:
         "Customize Google Calendar Event fields to Notion Database Column [field1:col1,field2:col2,...]",
         hinter=lambda:
         f"Valid Google Calendar fields: {GoogleCalendarService.FIELDS}\n"
-        f"Valid Notion Database columns: {list(str(c) for c in get_notion_db_col_list())}",
-        parser=parse_field_col_map)
+        f"Valid Notion Database columns: {list(str(c) for c in get_notion_db_col_list(config))}",
+        parser=functools.partial(parse_field_col_map, config))
     config.add(
         "col_const",
         "Customize synchronized Notion Database Columns to some constant [col1=const1,col2=const2,...]",
         hinter=lambda:
-        f"Valid Notion Database columns: {list(str(c) for c in get_notion_db_col_list())}",
+        f"Valid Notion Database columns: {list(str(c) for c in get_notion_db_col_list(config))}",
         default=None,
-        parser=parse_col_const)
+        parser=functools.partial(parse_col_const, config))
     config.add(
         "cal_merge",
         "Customize to merge one calendars into another on Notion [cal1>cal2,cal3>cal4,...]",
         default=None,
         parser=parse_cal_merge)
+    config.add(
+        "event_id_col",
+        "Database column (of type text; could be hidden) to keep the Google Calendar event ID of each page, so that --reconcile could rebuild local states from Notion [col]",
+        hinter=lambda:
+        f"Valid Notion Database columns: {list(str(c) for c in get_notion_db_col_list(config) if c.type == 'rich_text')}",
+        default=None,
+        parser=functools.partial(parse_event_id_col, config))
     return config
 
 
+# the configuration file: the only pipeline if it has no profiles, otherwise
+# the defaults of all profiles
 config = get_config()
 
 
-def load_config() -> None:
+def get_profile_config(profile: str) -> Config:
+    profile_config = get_config(profile)
+    profile_config.inherit(config)
+    return profile_config
+
+
+def get_durable_map_path(config: Config) -> str:
+    if config.profile is None:
+        return DURABLE_MAP_PATH
+    return os.path.join(DATA_DIR, f'gcal_notion.{config.profile}.db')
+
+
+def load_config() -> Tuple[Dict[str, Any], List[Config]]:
+    """
+    Load configurations; return the command-line arguments and the
+    configurations of the pipelines to run.
+    """
     arg_parser = argparse.ArgumentParser(
         prog="snow gcal-notion",
         description='Synchronize Google Calendar to Notion.')
+    arg_parser.add_argument(
+        "--refresh", action="store_true",
+        help="Look up calendars and the database by their names again, "
+        "instead of using the IDs resolved by previous runs")
+    arg_parser.add_argument(
+        "--workers", type=int, default=4,
+        help="Number of concurrent writes to Notion (default: 4)")
+    arg_parser.add_argument(
+        "--calendar_workers", type=int, default=1,
+        help="Number of calendars to synchronize concurrently (default: 1)")
+    arg_parser.add_argument(
+        "--listing_windows", type=int, default=1,
+        help="Number of time windows to list concurrently when listing a "
+        "calendar in full, e.g. in the first synchronization (default: 1)")
+    arg_parser.add_argument(
+        "--engine", choices=["thread", "async"], default="thread",
+        help="Send requests from a pool of threads, or from a single thread "
+        "with asyncio (default: thread); --workers and --calendar_workers "
+        "only apply to the thread engine")
+    arg_parser.add_argument(
+        "--metrics_out", "--metrics-out", metavar="PATH",
+        help="Write the time spent per phase, and the calls, retries and "
+        "latencies per API endpoint to the given JSON file")
+    arg_parser.add_argument(
+        "--reconcile", action="store_true",
+        help="Rebuild the event-to-page mappings from the pages on Notion "
+        "(requires event_id_col), then only create missing pages and archive "
+        "orphaned ones; e.g. after the local states are lost")
+    arg_parser.add_argument(
+        "--daemon", action="store_true",
+        help="Keep running and synchronize periodically: every "
+        "--min_interval seconds while events are changing, backing off to "
+        "every --max_interval seconds when idle; `snow --trigger` makes it "
+        "synchronize at once")
+    arg_parser.add_argument(
+        "--min_interval", type=float, default=5.0,
+        help="Shortest interval between synchronizations of a daemon in "
+        "seconds (default: 5)")
+    arg_parser.add_argument(
+        "--max_interval", type=float, default=60.0,
+        help="Longest interval between synchronizations of a daemon in "
+        "seconds (default: 60)")
+    arg_parser.add_argument(
+        "--trigger", action="store_true",
+        help="Ask the running daemon to synchronize now and wait for it")
+    arg_parser.add_argument(
+        "--profile",
+        help="Comma-separated names of the profiles to run, if the "
+        "configuration file defines some (default: all of them)")
+    arg_parser.add_argument(
+        "--preload", action="store_true",
+        help="Load all event-to-page mappings into memory before "
+        "synchronization (always done for a full synchronization)")
 
     if os.path.isfile(CACHED_CONFIG_FILE):
         config.load(CACHED_CONFIG_FILE)
@@ -189,21 +348,77 @@ def load_config() -> None:
         arg_parser.add_argument(f"--{name}", help=prompt)
 
     args = vars(arg_parser.parse_args(sys.argv[1:]))
+    if args["trigger"]:
+        # the daemon has everything loaded
+        return args, []
+    if args["min_interval"] <= 0 or args["max_interval"] < args["min_interval"]:
+        arg_parser.error("intervals must satisfy 0 < --min_interval <= "
+                         "--max_interval")
+    if args["listing_windows"] < 1:
+        arg_parser.error("--listing_windows must be positive")
+    # keep as many connections alive as requests could be in flight
+    if args["engine"] == "thread":
+        # a calendar may fetch missing events while its windows are listed
+        gcal.set_pool_size((args["listing_windows"] + 1)
+                           * args["calendar_workers"])
+        notion.set_pool_size(args["workers"] * args["calendar_workers"])
+    if args["profile"] is not None and not config.profiles:
+        arg_parser.error("--profile requires profiles defined in "
+                         f"{CACHED_CONFIG_FILE}")
+    profiles = config.get_profiles()
+    if args["profile"] is not None:
+        profiles = args["profile"].split(",")
+    for profile in profiles:
+        if profile not in config.profiles:
+            arg_parser.error(f"Profile {profile} not found")
+        if not re.fullmatch(r"[\w-]+", profile):
+            # it names the file of the profile's local states
+            arg_parser.error(f"Invalid profile name: {profile}")
+
+    if args["refresh"]:
+        config.clear_resolved()
+    configs = [get_profile_config(profile) for profile in profiles]
     for name, _ in config.get_entries():
         val = args[name]
         if val is None:
             continue
-        config.set_val(name, val)
+        # with profiles, values other than credentials only apply to the
+        # profiles of this run
+        if name in SHARED_ENTRIES or not configs:
+            config.set_val(name, val)
+        else:
+            for c in configs:
+                c.set_val(name, val)
 
-    if not config.is_all_set:
-        config.ask_interactive()
-    assert config.is_all_set
+    if configs:
+        # profiles are only set in the configuration file
+        args["interactive"] = False
+        for c in configs:
+            if args["refresh"]:
+                c.clear_resolved()
+            shared = SHARED_ENTRIES.intersection(config.profiles[c.profile])
+            if shared:
+                raise ValueError(f"Profile {c.profile} sets {sorted(shared)}, "
+                                 "which are shared by all profiles")
+            missing = [name for name, _ in c.get_entries()
+                       if c.values[name] is Config.MISSING]
+            if missing:
+                raise ValueError(f"Profile {c.profile} misses {missing}")
+    else:
+        args["interactive"] = not config.is_all_set
+        if not config.is_all_set:
+            config.ask_interactive()
+        assert config.is_all_set
+        configs = [config]
 
-    if not gcal.is_auth:
-        gcal.auth(config.get_parsed_val('gcal_creds_path'),
-                  config.get_parsed_val('gcal_token_path'))
-    if not notion.is_auth:
-        notion.auth(config.get_parsed_val('notion_token_path'))
+    get_gcal()
+    get_notion()
+    # validate all configurations (which may look up calendars and the
+    # database) before synchronization begins
+    with metrics.phase("config"):
+        for c in configs:
+            for name, _ in c.get_entries():
+                c.get_parsed_val(name)
 
     p = config.get_parsed_val('gcal_creds_path')
     if p != CACHED_GCAL_CREDS_PATH:
@@ -222,90 +437,986 @@ def load_config() -> None:
     config.set_val('notion_token_path', CACHED_NOTION_TOKEN_PATH)
 
     config.dump(CACHED_CONFIG_FILE)
+    return args, configs
+
 
+def get_event_ref(cal: Calendar, eid: str) -> str:
+    """
+    Return what is kept in `event_id_col` for the event. Event IDs are only
+    unique within a calendar, so it is prefixed by the calendar ID.
+    """
+    return f"{cal.id}/{eid}"
 
-def do_sync() -> None:
-    db = get_notion_active_db()
+
+def compile_page_plan(config: Config,
+                      cal: Calendar) -> Callable[[Event], Page]:
+    """
+    Compile how events of the calendar are turned into pages: the column of
+    each mapped field is looked up with its serializer resolved once, and the
+    properties that are the same for all events (the calendar name and the
+    constant columns) are serialized in advance. Return the function that
+    builds the page of an event in one pass.
+    """
     field_col_map = config.get_parsed_val("field_col_map")
-    cal_merge_map = config.get_parsed_val("cal_merge")
-    col_const_list = config.get_parsed_val("col_const")
 
-    # map gcal event id to notion database page id
-    sync_token_map = DurableMap(DURABLE_MAP_PATH, "SYNC_TOKEN_MAP")
+    #### Map Google Calendar fields to Notion Database columns ####
+    # FIELDS supported:
+    #   ["cal_name", "title", "time", "location", "description"]
+    # properties added before those of the event; they are copied, so each
+    # page keeps them in the same order as if added one by one
+    head = {}
+    col = field_col_map.get("cal_name")
+    if col is not None:
+        #### Redirect one calendar to another  ####
+        cal_name = config.get_parsed_val("cal_merge").get(cal.name, cal.name)
+        head[col.name] = PageBuilder.get_serializer(col)(cal_name)
+
+    col = field_col_map.get("time")
+    time_key = None if col is None else col.name
+
+    # "summary" looks less intuitive than "title" for end-users
+    # so we call it "title", through it's actually called "summary"
+    # in Google Calendar
+    fields = []
+    for field, event_field in [("title", "summary"),
+                               ("location", "location"),
+                               ("description", "description")]:
+        col = field_col_map.get(field)
+        if col is not None:
+            fields.append((event_field, col.name,
+                           PageBuilder.get_serializer(col)))
+
+    #### Add constant-value columns  ####
+    tail = {}
+    for col, const in config.get_parsed_val("col_const"):
+        tail[col.name] = PageBuilder.get_serializer(col)(const)
+
+    col = config.get_parsed_val("event_id_col")
+    event_id_key = None if col is None else col.name
+
+    def build_page(event: Event) -> Page:
+        with metrics.phase("build"):
+            data = dict(head)
+            if time_key is not None:
+                data[time_key] = PageBuilder.get_date(event.start, event.end)
+            for event_field, key, serialize in fields:
+                val = event[event_field]
+                if val is not None:
+                    data[key] = serialize(val)
+            data.update(tail)
+            if event_id_key is not None:
+                data[event_id_key] = PageBuilder.get_text(
+                    get_event_ref(cal, event.id))
+            return Page(data)
+    return build_page
+
+
+def get_id_map(store: DurableStore, cal: Calendar) -> DurableMap:
+    """Return the map from gcal event id to notion database page id."""
+    # table name must be sql-safe, so we use the hash value of the cal.name,
+    # instead of use it directly
+    return store.get_map(
+        f"ID_MAP_{hashlib.sha256(cal.name.encode('utf-8')).hexdigest()}")
+
+
+def get_prop_map(store: DurableStore, cal: Calendar) -> DurableMap:
+    """
+    Return the map from gcal event id to the fingerprint (in JSON) of the
+    properties last pushed to its page.
+    """
+    return store.get_map(
+        f"PROP_MAP_{hashlib.sha256(cal.name.encode('utf-8')).hexdigest()}")
+
+
+def get_journal(store: DurableStore, cal: Calendar) -> Journal:
+    """Return the journal of page writes sent for events of the calendar."""
+    return Journal(store.get_map(
+        f"JOURNAL_{hashlib.sha256(cal.name.encode('utf-8')).hexdigest()}"))
+
+
+def get_listing(sync_token: Optional[str],
+                time_min: Optional[datetime.datetime],
+                num_windows: int = 1) -> Dict[str, Any]:
+    """Identify a listing of events, so that a checkpoint is only resumed by
+    the same listing."""
+    listing = {"sync_token": sync_token,
+               "time_min": time_min.isoformat() if time_min is not None else None}
+    if time_min is not None and num_windows > 1:
+        # its page tokens are of ListingWindows
+        listing["num_windows"] = num_windows
+    return listing
+
+
+def load_checkpoint(checkpoint_map: DurableMap, cal: Calendar,
+                    listing: Dict[str, Any]) -> Optional[str]:
+    """
+    Return the page token to resume the listing of the calendar from, or None
+    if it has no checkpoint of the same listing.
+    """
+    val = checkpoint_map.get(cal.name)
+    if val is None:
+        return None
+    checkpoint = json.loads(val)
+    if checkpoint["listing"] != listing:
+        logging.info("Checkpoint of calendar %s is of another listing; "
+                     "will list from the first page", cal.name)
+        return None
+    logging.info("Resume listing calendar %s from a checkpoint", cal.name)
+    return checkpoint["page_token"]
+
+
+def save_checkpoint(checkpoint_map: DurableMap, cal: Calendar,
+                    listing: Dict[str, Any], page_token: str) -> None:
+    """
+    Remember that the listing is done until `page_token`; the results of all
+    writes planned so far must have been committed.
+    """
+    with metrics.phase("commit"):
+        checkpoint_map.put(cal.name, json.dumps({"listing": listing,
+                                                 "page_token": page_token}))
+
+
+def plan_update(prop_map: DurableMap, eid: str, page: Page) -> Optional[Page]:
+    """
+    Return the part of `page` that has changed since it was last pushed, or
+    None if nothing has changed.
+    """
+    fingerprint = prop_map.get(eid)
+    if fingerprint is None:  # never pushed with a fingerprint
+        return page
+    changed = page.diff(json.loads(fingerprint))
+    if not changed.data:
+        return None
+    return changed
+
+
+def get_created_page_filter(config: Config, page: Page) -> Optional[Dict]:
+    """
+    Return a Notion filter that matches the page once created: by the event
+    ID if `event_id_col` is set, otherwise by the title (None if the page has
+    no title to tell it from others).
+    """
+    event_id_col = config.get_parsed_val("event_id_col")
+    if event_id_col is not None:
+        return {"property": event_id_col.name, "rich_text": {
+            "equals": get_prop_value(page.data[event_id_col.name])}}
+    for col_name, prop in page.data.items():
+        if prop.get("type") == "title":
+            title = "".join(t["text"]["content"] for t in prop["title"])
+            return {"property": col_name, "title": {"equals": title}}
+    return None
+
+
+def log_write(config: Config,
+              journal: Journal,
+              write: PageWrite,
+              fingerprints: Dict[str, Dict[str, str]]) -> None:
+    """Log a planned write in the journal before it is sent."""
+    entry = {"op": write.op, "page_id": write.page_id,
+             "fingerprint": fingerprints.get(write.key)}
+    if write.op == PageWriter.CREATE:
+        # to find the page in case we crash before knowing its id
+        entry["filter"] = get_created_page_filter(config, write.page)
+        time_col = config.get_parsed_val("field_col_map").get("time")
+        if time_col is not None:
+            # instances of a recurring event share the title; their pages
+            # are told apart by the time
+            entry["time"] = [time_col.name, write.page.data[time_col.name]]
+        entry["planned_at"] = datetime.datetime.now(
+            datetime.timezone.utc).isoformat()
+    with metrics.phase("commit"):
+        journal.log(write.key, entry)
+
+
+def apply_write(id_map: Union[DurableMap, CachedMap],
+                prop_map: Union[DurableMap, CachedMap],
+                op: str, eid: str, page_id: Optional[str],
+                fingerprint: Optional[Dict[str, str]]) -> None:
+    if op == PageWriter.CREATE:
+        id_map.put(eid, page_id)
+    elif op == PageWriter.DELETE:
+        id_map.delete(eid)
+        prop_map.delete(eid)
+        return
+    prop_map.put(eid, json.dumps(fingerprint))
+
+
+def record_write(id_map: Union[DurableMap, CachedMap],
+                 prop_map: Union[DurableMap, CachedMap],
+                 journal: Journal,
+                 fingerprints: Dict[str, Dict[str, str]],
+                 op: str, eid: str, page: Optional[Page],
+                 error: Optional[Exception]) -> None:
+    """
+    Apply the result of a page write to `id_map` and `prop_map`, and mark it
+    done in the journal. `fingerprints` holds the fingerprints of pages being
+    created or updated.
+
+    A failed write leaves the mapping untouched and its journal entry in
+    doubt. Each result is committed in its own (cheap, thanks to WAL)
+    transaction, so that no calendar holds the database lock for its whole
+    synchronization; for preloaded maps, results are only written back at
+    `commit_maps`, and until then, the journal keeps them durable.
+    """
+    fingerprint = fingerprints.pop(eid, None)
+    if error is not None:
+        journal.mark_failed(eid)
+        return
+    page_id = None
+    if op == PageWriter.CREATE:
+        assert page.is_instantiated
+        page_id = page.id
+    # all maps share the same store
+    with metrics.phase("commit"), journal.transaction():
+        journal.mark_done(eid, {"op": op, "page_id": page_id,
+                                "fingerprint": fingerprint})
+        apply_write(id_map, prop_map, op, eid, page_id, fingerprint)
+
+
+def find_created_page(db: Database, entry: Dict,
+                      adopted: Set[str]) -> Optional[str]:
+    """
+    Return the id of the page created by an in-doubt create in the journal,
+    or None if it was not created (or cannot be told from others). Pages in
+    `adopted` are mapped to other events already.
+    """
+    if entry["filter"] is None:
+        logging.warning("Cannot tell whether the page of event %s was created "
+                        "(no title); it may be duplicated", entry["key"])
+        return None
+    # Notion's created_time is rounded down to the minute
+    planned_at = datetime.datetime.fromisoformat(entry["planned_at"])
+    created_after = planned_at.replace(second=0, microsecond=0)
+    pages = [p for p in db.query_pages({"and": [
+        entry["filter"],
+        {"timestamp": "created_time",
+         "created_time": {"on_or_after": created_after.isoformat()}}]})
+        if p.id not in adopted]
+    if entry.get("time") is not None:
+        col_name, prop = entry["time"]
+        val = get_prop_value(prop)
+        pages = [p for p in pages if get_prop_value(
+            p.data["properties"].get(col_name)) == val]
+    if not pages:
+        return None
+    if len(pages) > 1 and "title" in entry["filter"] \
+            and entry.get("time") is None:
+        # may be pages of other events with the same title
+        logging.warning("%d pages may be created for event %s; cannot tell "
+                        "which one, so it may be duplicated", len(pages),
+                        entry["key"])
+        return None
+    if len(pages) > 1:
+        logging.warning("%d pages may be created for event %s; adopt the "
+                        "earliest one", len(pages), entry["key"])
+        pages.sort(key=lambda p: p.data["created_time"])
+    return pages[0].id
+
+
+def replay_journal(cal: Calendar,
+                   db: Database,
+                   journal: Journal,
+                   id_map: Union[DurableMap, CachedMap],
+                   prop_map: Union[DurableMap, CachedMap]) -> None:
+    """
+    Recover from an interrupted synchronization of the calendar: apply the
+    writes that were done but not yet committed, and adopt the pages that
+    in-doubt creates may have created. In-doubt updates and deletes leave the
+    mappings untouched, so they will be planned again (they are idempotent).
+    This must happen before listing: the interrupted listing has no newer
+    checkpoint than its in-doubt writes, so their events will be listed again.
+    """
+    entries = journal.items()
+    if not entries:
+        return
+    logging.warning("Recover %d write(s) of calendar %s from an interrupted "
+                    "synchronization", len(entries), cal.name)
+    # pages mapped to other events, before or by the writes replayed below
+    adopted = set(page_id for _, page_id in id_map.items())
+    adopted.update(entry["page_id"] for entry in entries
+                   if entry.get("done") and entry["page_id"] is not None)
+    for entry in entries:
+        eid = entry["key"]
+        if entry.get("done"):
+            apply_write(id_map, prop_map, entry["op"], eid, entry["page_id"],
+                        entry["fingerprint"])
+        elif entry["op"] == PageWriter.CREATE:
+            page_id = find_created_page(db, entry, adopted)
+            if page_id is not None:
+                logging.info("Adopt page %s created for event %s",
+                             page_id, eid)
+                adopted.add(page_id)
+                apply_write(id_map, prop_map, PageWriter.CREATE, eid, page_id,
+                            entry["fingerprint"])
+    with journal.transaction():
+        journal.discard_all(commit=False)
+        commit_maps(id_map, prop_map, journal)
+
 
+def commit_maps(*maps: Union[DurableMap, CachedMap, Journal]) -> None:
+    with metrics.phase("commit"), maps[0].store.transaction():
+        for m in maps:
+            m.commit()
+
+
+def plan_orphan_deletes(cal: Calendar,
+                        id_map: Union[DurableMap, CachedMap],
+                        listed: Set[str],
+                        fields: str) -> List[PageWrite]:
+    """
+    Return the deletes of pages whose events are mapped but were not listed
+    by a full listing, and no longer exist on Google (those that still exist,
+    e.g. moved before `time_min`, are kept).
+    """
+    unlisted = {eid: page_id for eid, page_id in id_map.items()
+                if eid not in listed}
+    if not unlisted:
+        return []
+    events = cal.get_events(unlisted.keys(), fields=fields)
+    writes = []
+    for eid, page_id in unlisted.items():
+        event = events.get(eid)
+        if event is None or event.is_deleted:
+            writes.append(PageWrite(PageWriter.DELETE, eid, page_id, None))
+    return writes
+
+
+def is_sync_token_expired(cal: Calendar,
+                          e: Exception,
+                          sync_token: Optional[str]) -> bool:
+    """
+    Return whether a listing failed with `e` because its sync token has
+    expired, in which case the calendar should be listed in full again.
+    """
+    if sync_token is None or not GoogleCalendarService.is_sync_token_expired(e):
+        return False
+    # Google expires sync tokens (e.g. those unused for long); instead of
+    # starting over, all events are listed again and diffed against the
+    # mappings and fingerprints, so that only pages that differ are written
+    logging.warning(f"Sync token of calendar {cal.name} has expired; will "
+                    "list all events again")
+    return True
+
+
+def plan_write(build_page: Callable[[Event], Page],
+               event: Event,
+               id_map: Union[DurableMap, CachedMap],
+               prop_map: Union[DurableMap, CachedMap],
+               fingerprints: Dict[str, Dict[str, str]]) -> Optional[PageWrite]:
+    """
+    Decide which write (if any) brings the page of `event` up to date. The
+    previous write of the same event must have been recorded, otherwise
+    `id_map` may not have its page id yet.
+    """
+    eid = event.id
+    if event.is_deleted:
+        page_id = id_map.get(eid)
+        if page_id is None:
+            logging.info("Cancelled event %s not found locally; "
+                         "will not delete any page on Notion", event)
+            return None
+        return PageWrite(PageWriter.DELETE, eid, page_id, None)
+
+    page = build_page(event)
+    page_id = id_map.get(eid)
+    if page_id is None:
+        fingerprints[eid] = page.fingerprint()
+        return PageWrite(PageWriter.CREATE, eid, None, page)
+    # only send the properties that have changed
+    changed = plan_update(prop_map, eid, page)
+    if changed is None:
+        logging.info("Event %s has no change to push", eid)
+        return None
+    fingerprints[eid] = page.fingerprint()
+    return PageWrite(PageWriter.UPDATE, eid, page_id, changed)
+
+
+class CalendarSync:
+    """
+    The local states of synchronizing one calendar, and the steps that both
+    sync engines take on them; the engines only differ in how they list
+    events and send writes.
+    """
+
+    def __init__(self,
+                 config: Config,
+                 cal: Calendar,
+                 *,
+                 preload: bool = False,
+                 num_windows: int = 1) -> None:
+        self.config = config
+        self.cal = cal
+        self.preload = preload
+        self.num_windows = num_windows
+        # all local states of this calendar go through one connection
+        self.store = DurableStore(get_durable_map_path(config))
+        self.sync_token_map = self.store.get_map("SYNC_TOKEN_MAP")
+        self.checkpoint_map = self.store.get_map("CHECKPOINT_MAP")
+        self.id_map = get_id_map(self.store, cal)
+        self.prop_map = get_prop_map(self.store, cal)
+        self.journal = get_journal(self.store, cal)
+        self.sync_token = self.sync_token_map.get(cal.name)
+        self.time_min = None
+        if self.sync_token is None:
+            self.time_min = config.get_parsed_val("time_min")
+        # only ask for the event fields that are mapped to some columns
+        self.fields = GoogleCalendarService.get_event_fields(
+            config.get_parsed_val("field_col_map").keys())
+        self.build_page = None
+        self.fingerprints = {}
+        # IDs of events listed in full to replace an expired sync token
+        self.listed = None
+        self.listing = None
+        self.num_events = 0
+        # writes skipped as they would change nothing
+        self.num_skipped_cancels = 0
+        self.num_unchanged = 0
+
+    def open(self, db: Database) -> None:
+        """Recover from an interrupted synchronization (see replay_journal)."""
+        if self.preload or self.sync_token is None:
+            # a full listing looks up (nearly) every mapping, so it's cheaper
+            # to load them all at once
+            self.id_map = CachedMap(self.id_map)
+            self.prop_map = CachedMap(self.prop_map)
+        replay_journal(self.cal, db, self.journal, self.id_map, self.prop_map)
+        self.build_page = compile_page_plan(self.config, self.cal)
+
+    def close(self) -> None:
+        # write back what has been synchronized, even if failed halfway
+        commit_maps(self.id_map, self.prop_map, self.journal)
+        self.store.close()
+
+    def start_listing(self) -> Optional[str]:
+        """Return the page token to resume the listing from, if any."""
+        self.listing = get_listing(self.sync_token, self.time_min,
+                                   self.num_windows)
+        return load_checkpoint(self.checkpoint_map, self.cal, self.listing)
+
+    def get_on_done(self) -> Callable[..., None]:
+        # writes are sent concurrently, but their results are applied to
+        # `id_map` in the order of events
+        return functools.partial(record_write, self.id_map, self.prop_map,
+                                 self.journal, self.fingerprints)
+
+    def add_page(self, events_page: EventsPage) -> None:
+        self.num_events += len(events_page.events)
+        if self.listed is not None:
+            self.listed.update(event.id for event in events_page.events)
+
+    def plan_event(self, event: Event) -> Optional[PageWrite]:
+        """
+        Return the write of the event's page (if any), logged in the
+        journal; the previous write of the same event must be settled.
+        """
+        write = plan_write(self.build_page, event, self.id_map, self.prop_map,
+                           self.fingerprints)
+        if write is not None:
+            log_write(self.config, self.journal, write, self.fingerprints)
+        elif event.is_deleted:
+            self.num_skipped_cancels += 1
+        else:
+            self.num_unchanged += 1
+        return write
+
+    def report_skipped(self) -> None:
+        if self.num_skipped_cancels == 0 and self.num_unchanged == 0:
+            return
+        logging.info("Skip writing %d cancelled event(s) without a page and "
+                     "%d unchanged event(s) of calendar %s",
+                     self.num_skipped_cancels, self.num_unchanged,
+                     self.cal.name)
+        metrics.count("notion.pages.update", "skipped_cancels",
+                      self.num_skipped_cancels)
+        metrics.count("notion.pages.update", "skipped_unchanged",
+                      self.num_unchanged)
+
+    @staticmethod
+    def should_checkpoint(events_page: EventsPage, num_failed: int) -> bool:
+        # a failed write must be retried, so don't checkpoint past it
+        return events_page.next_page_token is not None and num_failed == 0
+
+    def checkpoint(self, events_page: EventsPage, num_failed: int) -> None:
+        """Checkpoint after the page, once its writes have been flushed."""
+        if num_failed > 0:
+            return
+        commit_maps(self.id_map, self.prop_map, self.journal)
+        save_checkpoint(self.checkpoint_map, self.cal, self.listing,
+                        events_page.next_page_token)
+
+    def plan_orphan_deletes(self) -> List[PageWrite]:
+        """Return the logged deletes of orphan pages after a full listing."""
+        if self.listed is None:
+            return []
+        writes = plan_orphan_deletes(self.cal, self.id_map, self.listed,
+                                     self.fields)
+        for write in writes:
+            log_write(self.config, self.journal, write, self.fingerprints)
+        return writes
+
+    def restart_listing(self, e: Exception) -> bool:
+        """
+        Return whether the listing should start over in full because it
+        failed with `e` for an expired sync token; otherwise, `e` should be
+        raised.
+        """
+        if not is_sync_token_expired(self.cal, e, self.sync_token):
+            return False
+        commit_maps(self.id_map, self.prop_map, self.journal)
+        self.sync_token = None
+        self.time_min = self.config.get_parsed_val("time_min")
+        if not isinstance(self.id_map, CachedMap):
+            self.id_map = CachedMap(self.id_map)
+            self.prop_map = CachedMap(self.prop_map)
+        self.listed = set()
+        return True
+
+    def finish(self, next_sync_token: str, num_failed: int) -> int:
+        """
+        Commit the sync token of a finished listing, unless some writes
+        failed; return the number of events listed.
+        """
+        self.report_skipped()
+        if num_failed > 0:
+            # keep the old sync token (and checkpoint) so that the next run
+            # retries this delta; the writes that succeeded have been recorded
+            # in `id_map`, so they won't be duplicated
+            logging.error(f"{num_failed} write(s) failed for calendar "
+                          f"{self.cal.name}; will retry them in the next run")
+            return self.num_events
+        # mappings must be durable before the sync token moves on
+        commit_maps(self.id_map, self.prop_map, self.journal)
+        with metrics.phase("commit"), self.store.transaction():
+            self.sync_token_map.put(self.cal.name, next_sync_token,
+                                    commit=False)
+            self.checkpoint_map.delete(self.cal.name, commit=False)
+        return self.num_events
+
+
+def sync_calendar(config: Config,
+                  cal: Calendar,
+                  *,
+                  num_workers: int = 4,
+                  preload: bool = False,
+                  num_windows: int = 1) -> int:
+    """
+    Synchronize one calendar to the database of the configuration.
+
+    Events are streamed from Google: pages are written to Notion while the
+    following pages are still being fetched.
+    Each calendar has its own connection to the local states and commits its
+    own sync token, so calendars could be synchronized concurrently.
+    If `preload`, the mappings are loaded into memory at the beginning and
+    written back at the end; this is always the case for a full listing.
+
+    Writes that would change nothing, i.e. deletes for cancelled events that
+    have no page and updates of unchanged pages, are skipped and reported.
+
+    Every write is logged in the calendar's journal before it is sent, and
+    after each page of events, the listing is checkpointed (once all writes
+    so far are committed); an interrupted synchronization is recovered from
+    the journal and resumed from the checkpoint by the next run.
+
+    If Google has expired the sync token, the calendar is listed in full
+    again from `time_min` and diffed against the mappings and fingerprints:
+    only pages that differ are written, and those of events gone meanwhile
+    are archived.
+
+    Return the number of events listed (i.e. added, changed or cancelled
+    since the last synchronization).
+    """
+    db = get_notion_active_db(config)
+    sync = CalendarSync(config, cal, preload=preload, num_windows=num_windows)
+    try:
+        sync.open(db)
+        while True:
+            page_token = sync.start_listing()
+            try:
+                with cal.stream_events(time_min=sync.time_min,
+                                       sync_token=sync.sync_token,
+                                       fields=sync.fields,
+                                       page_token=page_token,
+                                       num_windows=num_windows) as stream, \
+                        PageWriter(db, sync.get_on_done(),
+                                   max_workers=num_workers) as writer:
+                    for events_page in stream.iter_pages():
+                        sync.add_page(events_page)
+                        for event in events_page.events:
+                            writer.settle(event.id)
+                            write = sync.plan_event(event)
+                            if write is not None:
+                                writer.submit(write)
+                        if sync.should_checkpoint(events_page,
+                                                  writer.num_failed):
+                            writer.flush()
+                            sync.checkpoint(events_page, writer.num_failed)
+                    for write in sync.plan_orphan_deletes():
+                        writer.submit(write)
+                break
+            except Exception as e:
+                if not sync.restart_listing(e):
+                    raise
+        return sync.finish(stream.next_sync_token, writer.num_failed)
+    finally:
+        sync.close()
+
+
+def get_pipelines(configs: List[Config]) -> List[Tuple[Config, Calendar]]:
+    """Return the (configuration, calendar) pairs to synchronize."""
+    return [(config, cal) for config in configs
+            for cal in config.get_parsed_val("cal_list")]
+
+
+def get_pipeline_name(config: Config, cal: Calendar) -> str:
+    if config.profile is None:
+        return cal.name
+    return f"{config.profile}/{cal.name}"
+
+
+def for_each_calendar(fn: Callable[..., Any],
+                      configs: List[Config],
+                      *,
+                      num_cal_workers: int = 1,
+                      **kwargs: Any) -> List[Any]:
+    """
+    Run `fn(config, cal, **kwargs)` for all calendars of all configurations
+    with one pool of threads; return their results.
+    """
+    pipelines = get_pipelines(configs)
+    results = []
+    failed_cal_names = []
+    with ThreadPoolExecutor(max_workers=num_cal_workers,
+                            thread_name_prefix="calendar") as executor:
+        futures = [(config, cal, executor.submit(fn, config, cal, **kwargs))
+                   for config, cal in pipelines]
+        # a failed calendar does not affect the others: what it has committed
+        # stays committed, and it will be retried in the next run
+        for config, cal, future in futures:
+            name = get_pipeline_name(config, cal)
+            try:
+                results.append(future.result())
+            except Exception:
+                logging.exception(f"Fail to synchronize calendar {name}")
+                failed_cal_names.append(name)
+    if failed_cal_names:
+        raise RuntimeError(f"Fail to synchronize calendar(s): {failed_cal_names}")
+    return results
+
+
+def do_sync(configs: List[Config],
+            *,
+            num_workers: int = 4,
+            num_cal_workers: int = 1,
+            preload: bool = False,
+            num_windows: int = 1) -> int:
+    """
+    Synchronize all calendars of the configurations; return the number of
+    events listed.
+    """
     # get from google calendar for events added or updated
-    for cal in config.get_parsed_val("cal_list"):
-        # table name must be sql-safe, so we use the hash value of the cal.name,
-        # instead of use it directly
-        id_map = DurableMap(
-            DURABLE_MAP_PATH,
-            f"ID_MAP_{hashlib.sha256(cal.name.encode('utf-8')).hexdigest()}")
-        sync_token = sync_token_map.get(cal.name)
-        time_min = None
-        if sync_token is None:
-            time_min = config.get_parsed_val("time_min")
-        events_id_list, next_sync_token = cal.list_events_id(
-            time_min=time_min, sync_token=sync_token)
-
-        for eid in events_id_list:
-            event = cal.get_event(eid)
-            if event.is_deleted:
-                page_id = id_map.get(eid)
-                if page_id is not None:
-                    db.delete_page(page_id)
-                    id_map.delete(eid)
-                else:
-                    logging.info(f"Cancelled event {event} not found locally; "
-                                 "will not delete any page on Notion")
+    return sum(for_each_calendar(sync_calendar, configs,
+                                 num_cal_workers=num_cal_workers,
+                                 num_workers=num_workers, preload=preload,
+                                 num_windows=num_windows))
+
+
+async def sync_calendar_async(config: Config,
+                              cal: Calendar,
+                              fetcher: 'AsyncEventFetcher',
+                              *,
+                              preload: bool = False,
+                              num_windows: int = 1) -> int:
+    """The same as `sync_calendar`, but all requests are sent with asyncio."""
+    from service.notion.aio import AsyncPageWriter
+    sync_db = get_notion_active_db(config)
+    db = notion.get_async_database(sync_db)
+    sync = CalendarSync(config, cal, preload=preload, num_windows=num_windows)
+    try:
+        # recovery is rare, so it's fine to block the loop with it
+        sync.open(sync_db)
+        while True:
+            page_token = sync.start_listing()
+            try:
+                async with fetcher.stream_events(
+                        cal, time_min=sync.time_min,
+                        sync_token=sync.sync_token, fields=sync.fields,
+                        page_token=page_token,
+                        num_windows=num_windows) as stream, \
+                        AsyncPageWriter(db, sync.get_on_done()) as writer:
+                    async for events_page in stream.iter_pages():
+                        sync.add_page(events_page)
+                        for event in events_page.events:
+                            await writer.settle(event.id)
+                            write = sync.plan_event(event)
+                            if write is not None:
+                                await writer.submit(write)
+                        if sync.should_checkpoint(events_page,
+                                                  writer.num_failed):
+                            await writer.flush()
+                            sync.checkpoint(events_page, writer.num_failed)
+                    # as rare as recovery, so it may block the loop
+                    for write in sync.plan_orphan_deletes():
+                        await writer.submit(write)
+                break
+            except Exception as e:
+                if not sync.restart_listing(e):
+                    raise
+        return sync.finish(stream.next_sync_token, writer.num_failed)
+    finally:
+        sync.close()
+
+
+async def do_sync_async(configs: List[Config],
+                        *,
+                        preload: bool = False,
+                        num_windows: int = 1) -> int:
+    """
+    Synchronize all calendars of the configurations on a single thread:
+    requests of all calendars are multiplexed on one event loop (still under
+    Notion's rate limits). Return the number of events listed.
+    """
+    import asyncio
+    pipelines = get_pipelines(configs)
+    # all calendars (and their windows) are listed at the same time
+    fetcher = gcal.get_async_fetcher(pool_size=len(pipelines) * num_windows)
+    try:
+        results = await asyncio.gather(
+            *(sync_calendar_async(config, cal, fetcher, preload=preload,
+                                  num_windows=num_windows)
+              for config, cal in pipelines),
+            return_exceptions=True)
+    finally:
+        await fetcher.aclose()
+        await notion.aclose()
+    failed_cal_names = []
+    for (config, cal), res in zip(pipelines, results):
+        if isinstance(res, Exception):
+            name = get_pipeline_name(config, cal)
+            logging.error(f"Fail to synchronize calendar {name}",
+                          exc_info=res)
+            failed_cal_names.append(name)
+    if failed_cal_names:
+        raise RuntimeError(f"Fail to synchronize calendar(s): {failed_cal_names}")
+    return sum(results)
+
+
+def query_calendar_pages(cal: Calendar,
+                         db: Database,
+                         event_id_col: Column,
+                         id_map: Union[DurableMap, CachedMap]
+                         ) -> Tuple[Dict[str, Page], List[Page]]:
+    """
+    Return the pages on Notion of events of the calendar by event ID, and the
+    duplicated ones (a page per event is kept, preferably the one `id_map`
+    already maps to).
+    """
+    prefix = get_event_ref(cal, "")
+    pages = {}
+    duplicates = []
+    with metrics.phase("query"):
+        for page in db.query_pages({"property": event_id_col.name,
+                                    "rich_text": {"starts_with": prefix}}):
+            ref = get_prop_value(page.data["properties"][event_id_col.name])
+            eid = ref[len(prefix):]
+            kept = pages.setdefault(eid, page)
+            if kept is page:
+                continue
+            if id_map.get(eid) == page.id:
+                pages[eid] = page
+                page = kept
+            duplicates.append(page)
+    return pages, duplicates
+
+
+def adopt_page(build_page: Callable[[Event], Page],
+               event: Event,
+               page: Page,
+               id_map: Union[DurableMap, CachedMap],
+               prop_map: Union[DurableMap, CachedMap]) -> bool:
+    """
+    Map the event to its page found on Notion; return whether the page is up
+    to date, in which case its fingerprint is recorded so that no write is
+    planned for it.
+    """
+    id_map.put(event.id, page.id)
+    if not event.is_deleted:
+        built = build_page(event)
+        if built.is_same_as(page):
+            prop_map.put(event.id, json.dumps(built.fingerprint()))
+            return True
+    # unknown properties; the whole page will be written if it's planned
+    prop_map.delete(event.id)
+    return False
+
+
+def reconcile_calendar(config: Config,
+                       cal: Calendar,
+                       *,
+                       num_workers: int = 4,
+                       num_windows: int = 1) -> None:
+    """
+    Rebuild the mappings of one calendar from the pages on Notion, and diff
+    them against a full listing of events on Google: only pages that are
+    missing or out of date are written, and orphaned pages (of events that
+    no longer exist) are archived. The calendar then has a new sync token, so
+    the following synchronizations are incremental again.
+
+    Pages are told apart by the event ID in `event_id_col`; pages without it
+    (e.g. created before it was set) are left alone, and those mapped
+    locally get it in their next write.
+    """
+    db = get_notion_active_db(config)
+    event_id_col = config.get_parsed_val("event_id_col")
+    assert event_id_col is not None
+
+    store = DurableStore(get_durable_map_path(config))
+    sync_token_map = store.get_map("SYNC_TOKEN_MAP")
+    checkpoint_map = store.get_map("CHECKPOINT_MAP")
+    id_map = CachedMap(get_id_map(store, cal))
+    prop_map = CachedMap(get_prop_map(store, cal))
+    journal = get_journal(store, cal)
+    try:
+        replay_journal(cal, db, journal, id_map, prop_map)
+        pages, duplicates = query_calendar_pages(cal, db, event_id_col, id_map)
+        stats = Counter(found=len(pages) + len(duplicates))
+
+        fingerprints = {}
+        on_done = functools.partial(record_write, id_map, prop_map, journal,
+                                    fingerprints)
+        fields = GoogleCalendarService.get_event_fields(
+            config.get_parsed_val("field_col_map").keys())
+        build_page = compile_page_plan(config, cal)
+        time_min = config.get_parsed_val("time_min")
+        with cal.stream_events(time_min=time_min, fields=fields,
+                               num_windows=num_windows) as stream, \
+                PageWriter(db, on_done, max_workers=num_workers) as writer:
+            for page in duplicates:
+                # keyed by the page, so that it won't touch the mappings
+                write = PageWrite(PageWriter.DELETE, page.id, page.id, None)
+                stats[write.op] += 1
+                log_write(config, journal, write, fingerprints)
+                writer.submit(write)
+
+            for event in stream:
+                writer.settle(event.id)
+                page = pages.pop(event.id, None)
+                if page is not None and adopt_page(build_page, event, page,
+                                                   id_map, prop_map):
+                    stats["up_to_date"] += 1
+                    continue
+                write = plan_write(build_page, event, id_map, prop_map,
+                                   fingerprints)
+                if write is not None:
+                    stats[write.op] += 1
+                    log_write(config, journal, write, fingerprints)
+                    writer.submit(write)
+
+            # pages not listed are either of events before `time_min` (kept)
+            # or orphaned; the dates on pages may be stale (e.g. an event
+            # moved before `time_min`), so all of them are looked up
+            events = cal.get_events(pages.keys(), fields=fields)
+            for eid, page in pages.items():
+                id_map.put(eid, page.id)
+                event = events.get(eid)
+                if event is not None and not event.is_deleted:
+                    stats["kept"] += 1
+                    continue
+                write = PageWrite(PageWriter.DELETE, eid, page.id, None)
+                stats[write.op] += 1
+                log_write(config, journal, write, fingerprints)
+                writer.submit(write)
+        next_sync_token = stream.next_sync_token
+
+        logging.warning(
+            f"Reconcile calendar {cal.name}: {stats['found']} page(s) found "
+            f"on Notion; {stats['up_to_date'] + stats['kept']} kept as is, "
+            f"{stats[PageWriter.UPDATE]} updated, "
+            f"{stats[PageWriter.CREATE]} created, "
+            f"{stats[PageWriter.DELETE]} archived")
+        if writer.num_failed > 0:
+            logging.error(f"{writer.num_failed} write(s) failed for calendar "
+                          f"{cal.name}; run --reconcile again to retry them")
+            return
+        commit_maps(id_map, prop_map, journal)
+        with metrics.phase("commit"), store.transaction():
+            sync_token_map.put(cal.name, next_sync_token, commit=False)
+            checkpoint_map.delete(cal.name, commit=False)
+    finally:
+        commit_maps(id_map, prop_map, journal)
+        store.close()
+
+
+def do_reconcile(configs: List[Config],
+                 *,
+                 num_workers: int = 4,
+                 num_cal_workers: int = 1,
+                 num_windows: int = 1) -> None:
+    for config in configs:
+        if config.get_parsed_val("event_id_col") is None:
+            raise ValueError("--reconcile requires event_id_col to be set")
+    for_each_calendar(reconcile_calendar, configs,
+                      num_cal_workers=num_cal_workers,
+                      num_workers=num_workers, num_windows=num_windows)
+
+
+def run_sync(args: Dict[str, Any], configs: List[Config]) -> int:
+    """Synchronize all calendars with the engine of `args`."""
+    if args["engine"] == "async":
+        import asyncio
+        return asyncio.run(do_sync_async(
+            configs, preload=args["preload"],
+            num_windows=args["listing_windows"]))
+    return do_sync(configs,
+                   num_workers=args["workers"],
+                   num_cal_workers=args["calendar_workers"],
+                   preload=args["preload"],
+                   num_windows=args["listing_windows"])
+
+
+def run_daemon(args: Dict[str, Any], configs: List[Config]) -> None:
+    """
+    Synchronize periodically with warm services (authenticated, with
+    connections kept alive and configurations validated), until killed.
+    Each synchronization is incremental, so it only costs one listing request
+    per calendar if nothing has changed. The interval is reset to
+    `min_interval` whenever some event has changed, and doubles (up to
+    `max_interval`) otherwise; requests on DAEMON_SOCKET_PATH wake it up at
+    once and are answered when the synchronization is done.
+    """
+    import signal
+    # exit through `finally` on `kill`, so that the socket is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    server = TriggerServer(DAEMON_SOCKET_PATH)
+    logging.info(f"Listen on {DAEMON_SOCKET_PATH}")
+    interval = args["min_interval"]
+    waiters = []
+    try:
+        while True:
+            try:
+                with metrics.phase("sync"):
+                    num_events = run_sync(args, configs)
+                msg = f"done: {num_events} event(s) synchronized"
+            except Exception as e:
+                logging.exception("Fail to synchronize")
+                num_events = 0
+                msg = f"failed: {e}"
+            server.reply(waiters, msg)
+            if args["metrics_out"] is not None:
+                metrics.dump(args["metrics_out"])
+
+            if num_events > 0:
+                interval = args["min_interval"]
             else:
-                pb = PageBuilder()
-
-                #### Map Google Calendar fields to Notion Database columns ####
-                # FIELDS supported:
-                #   ["cal_name", "title", "time", "location", "description"]
-                col = field_col_map.get("cal_name")
-                if col is not None:
-                    cal_name = cal.name
-                    #### Redirect one calendar to another  ####
-                    if cal_name in cal_merge_map:
-                        cal_name = cal_merge_map[cal_name]
-                    pb.add_column(col, cal_name)
-
-                col = field_col_map.get("time")
-                if col is not None:
-                    pb.add_date(col.name, event.start, event.end)
-
-                # "summary" looks less intuitive than "title" for end-users
-                # so we call it "title", through it's actually called "summary"
-                # in Google Calendar
-                col = field_col_map.get("title")
-                if col is not None:
-                    val = event["summary"]
-                    if val is not None:
-                        pb.add_column(col, val)
-
-                for field in ["location", "description"]:
-                    col = field_col_map.get(field)
-                    val = event[field]
-                    if col is not None and val is not None:
-                        pb.add_column(col, val)
-
-                #### Add constant-value columns  ####
-                for col, const in col_const_list:
-                    pb.add_column(col, const)
-
-                page = pb.build()
-                page_id = id_map.get(eid)
-                if page_id is None:
-                    p = db.create_page(page)
-                    assert p.is_instantiated
-                    id_map.put(eid, p.id)
-                else:
-                    db.update_page(page_id, page)
-        id_map.commit()
-        id_map.close()
-        sync_token_map.put(cal.name, next_sync_token, commit=True)
-    sync_token_map.close()
+                interval = min(2 * interval, args["max_interval"])
+            # refresh the token while idle, instead of in the next sync
+            try:
+                gcal.refresh_creds(datetime.timedelta(
+                    seconds=interval + TOKEN_REFRESH_MARGIN_SEC))
+            except Exception:
+                logging.exception("Fail to refresh the Google token")
+            waiters = server.wait(interval)
+    finally:
+        server.close()
 
 
 if __name__ == "__main__":
@@ -321,5 +1432,34 @@ if __name__ == "__main__":
             raise ValueError(f"Unknown log level: {log_level}")
 
     os.makedirs(DATA_DIR, exist_ok=True)
-    load_config()
-    do_sync()
+    args, configs = load_config()
+    if args["trigger"]:
+        try:
+            res = send_trigger(DAEMON_SOCKET_PATH)
+        except (FileNotFoundError, ConnectionRefusedError):
+            print(f"No daemon is listening on {DAEMON_SOCKET_PATH}; start "
+                  "one with `snow --daemon`", file=sys.stderr)
+            sys.exit(1)
+        print(res)
+        sys.exit(0 if res.startswith("done") else 1)
+    startup_time = time.perf_counter() - START_TIME
+    metrics.add_phase("startup", startup_time)
+    logging.info(f"Start up in {startup_time:.3f}s")
+    if startup_time > STARTUP_BUDGET_SEC and not args["interactive"]:
+        logging.warning(f"Start up in {startup_time:.3f}s, longer than the "
+                        f"budget of {STARTUP_BUDGET_SEC:.3f}s")
+    try:
+        if args["reconcile"]:
+            with metrics.phase("sync"):
+                do_reconcile(configs,
+                             num_workers=args["workers"],
+                             num_cal_workers=args["calendar_workers"],
+                             num_windows=args["listing_windows"])
+        elif args["daemon"]:
+            run_daemon(args, configs)
+        else:
+            with metrics.phase("sync"):
+                run_sync(args, configs)
+    finally:
+        if args["metrics_out"] is not None:
+            metrics.dump(args["metrics_out"])
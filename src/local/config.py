@@ -1,6 +1,6 @@
 import os
 from collections import OrderedDict
-from typing import Callable, Any
+from typing import Callable, Any, List, Optional
 import json
 
 
@@ -15,11 +15,23 @@ class Config:
             return self.string
 
     MISSING = ConfigOption("???")
-
-    def __init__(self) -> None:
+    # key in the dumped JSON to keep `resolved`
+    RESOLVED_KEY = "__resolved__"
+    # key in the dumped JSON to keep `profiles`
+    PROFILES_KEY = "__profiles__"
+
+    def __init__(self, profile: Optional[str] = None) -> None:
+        # name of the profile, or None for the configuration file itself
+        self.profile = profile
         self.entries = OrderedDict()
         self.values = {}
         self.parsed_values = {}
+        # what parsers have resolved from a value (e.g. IDs of the named
+        # objects), so that later runs could skip looking them up
+        self.resolved = {}
+        # profile name -> its own values (and `resolved`); only the
+        # configuration file keeps them
+        self.profiles = {}
 
     def get_entries(self):
         return self.entries.items()
@@ -58,14 +70,57 @@ class Config:
             self.parsed_values[name] = parser(self.values[name])
         return self.parsed_values[name]
 
+    def get_resolved(self, name: str, val: str) -> Optional[Any]:
+        """Return what has been resolved from `val` for the entry, if any."""
+        resolved = self.resolved.get(name)
+        if resolved is None or resolved[0] != val:
+            return None
+        return resolved[1]
+
+    def set_resolved(self, name: str, val: str, resolved: Any) -> None:
+        # must be JSON-serializable
+        self.resolved[name] = [val, resolved]
+
+    def clear_resolved(self) -> None:
+        # cleared in place, as a profile shares it with `profiles`
+        self.resolved.clear()
+
+    def get_profiles(self) -> List[str]:
+        return list(self.profiles.keys())
+
+    def inherit(self, base: 'Config') -> None:
+        """
+        Take the values of `base` as defaults, then override them with the
+        values of this profile kept by `base`. What is resolved for this
+        profile is kept by `base` as well, so it is saved with `base.dump`.
+        """
+        assert self.profile in base.profiles
+        values = base.profiles[self.profile]
+        self.values.update((name, val) for name, val in base.values.items()
+                           if name in self.entries)
+        self.values.update((name, val) for name, val in values.items()
+                           if name in self.entries)
+        self.parsed_values = {}
+        self.resolved = values.setdefault(self.RESOLVED_KEY, {})
+
     def load(self, path) -> None:
         with open(path, 'r') as f:
-            self.values = json.load(f)
+            values = json.load(f)
+        self.resolved = values.pop(self.RESOLVED_KEY, {})
+        self.profiles = values.pop(self.PROFILES_KEY, {})
+        # entries added after the file was dumped keep their defaults
+        self.values.update(values)
 
     def dump(self, path) -> None:
         path_tmp = f"{path}.tmp"
         with open(path_tmp, 'w') as f:
-            json.dump(self.values, f, allow_nan=False, indent='\t')
+            # with profiles, entries they set may be missing here
+            values = {name: val for name, val in self.values.items()
+                      if val is not self.MISSING}
+            values[self.RESOLVED_KEY] = self.resolved
+            if self.profiles:
+                values[self.PROFILES_KEY] = self.profiles
+            json.dump(values, f, allow_nan=False, indent='\t')
             f.flush()
             os.fsync(f.fileno())
         os.rename(path_tmp, path)
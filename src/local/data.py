@@ -1,35 +1,89 @@
 """
 Maintain durable data on the local machine with a key-value interface.
 """
+import contextlib
 import sqlite3
 import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+
+class DurableStore:
+    """
+    A connection to a local database, shared by all DurableMaps (tables) in
+    it. A connection must only be used by the thread that opens it.
+    """
+    # SQLite limits the number of host parameters of a statement
+    MAX_VARS = 500
+
+    def __init__(self, path: str) -> None:
+        self.con = sqlite3.connect(path, timeout=30)
+        # with WAL, readers don't block the writer (e.g. another calendar) and
+        # a commit only appends to the log; `synchronous=NORMAL` then only
+        # syncs at checkpoints, which is still consistent after a crash
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.txn_depth = 0
+
+    def close(self) -> None:
+        self.con.close()
+
+    def commit(self) -> None:
+        # within a transaction scope, commit when the outermost scope exits
+        if self.txn_depth == 0:
+            self.con.commit()
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Group all writes (to any map of this store) within the scope into one
+        transaction: committed if the scope exits normally, rolled back
+        otherwise. Scopes could be nested.
+        """
+        self.txn_depth += 1
+        try:
+            yield
+        except BaseException:
+            self.txn_depth -= 1
+            if self.txn_depth == 0:
+                self.con.rollback()
+            raise
+        self.txn_depth -= 1
+        if self.txn_depth == 0:
+            self.con.commit()
+
+    def get_map(self, tname: str) -> 'DurableMap':
+        return DurableMap(self, tname)
 
 
 class DurableMap:
     re_tname = re.compile(r"\A[a-zA-Z_][a-zA-Z0-9_]*\Z")
 
-    def __init__(self, path: str, tname: str) -> None:
+    def __init__(self, store: Union[DurableStore, str], tname: str) -> None:
         # tname must be SQL-safe!
         assert self.re_tname.fullmatch(tname) is not None
         self.tname = tname
-        self.con = sqlite3.connect(path)
+        # a map opened with a path owns its connection
+        self.owns_store = not isinstance(store, DurableStore)
+        self.store = DurableStore(store) if self.owns_store else store
+        self.con = self.store.con
         self.cur = self.con.cursor()
+        # several connections (e.g. one per calendar) may race to create the
+        # same table
         self.cur.execute(
-            "SELECT count(name) "
-            "FROM sqlite_schema "
-            "WHERE type = 'table' AND name = :tname", {"tname": tname})
-
-        if self.cur.fetchone()[0] == 0:
-            self.cur.execute(
-                f"CREATE TABLE {tname} (dm_key TEXT NOT NULL UNIQUE PRIMARY KEY, dm_val TEXT)"
-            )
-        self.con.commit()
+            f"CREATE TABLE IF NOT EXISTS {tname} "
+            "(dm_key TEXT NOT NULL UNIQUE PRIMARY KEY, dm_val TEXT)")
+        self.store.commit()
 
     def close(self) -> None:
-        self.con.close()
+        if self.owns_store:
+            self.store.close()
 
     def commit(self) -> None:
-        self.con.commit()
+        self.store.commit()
+
+    def transaction(self) -> contextlib.AbstractContextManager:
+        """Transaction scope of the underlying store (i.e. all its maps)."""
+        return self.store.transaction()
 
     def get(self, key: str) -> str:
         res = self.cur.execute(
@@ -41,6 +95,21 @@ class DurableMap:
             return res[0][0]
         return None
 
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Return the values of the keys found (missing ones are omitted)."""
+        keys = list(keys)
+        res = {}
+        for i in range(0, len(keys), DurableStore.MAX_VARS):
+            chunk = keys[i:i + DurableStore.MAX_VARS]
+            res.update(self.cur.execute(
+                f"SELECT dm_key, dm_val FROM {self.tname} "
+                f"WHERE dm_key IN ({','.join('?' * len(chunk))})", chunk))
+        return res
+
+    def items(self) -> List[Tuple[str, str]]:
+        return self.cur.execute(
+            f"SELECT dm_key, dm_val FROM {self.tname}").fetchall()
+
     def put(self, key: str, val: str = None, commit: bool = True) -> None:
         self.cur.execute(
             f"INSERT OR REPLACE INTO {self.tname} (dm_key, dm_val) VALUES (:key, :val)",
@@ -51,6 +120,14 @@ class DurableMap:
         if commit:
             self.commit()
 
+    def put_many(self, items: Iterable[Tuple[str, Optional[str]]],
+                 commit: bool = True) -> None:
+        self.cur.executemany(
+            f"INSERT OR REPLACE INTO {self.tname} (dm_key, dm_val) VALUES (?, ?)",
+            items)
+        if commit:
+            self.commit()
+
     def insert(self, key: str, val: str = None, commit: bool = True) -> None:
         self.cur.execute(
             f"INSERT INTO {self.tname} (dm_key, dm_val) VALUES (:key, :val)", {
@@ -62,7 +139,7 @@ class DurableMap:
 
     def update(self, key: str, val: str, commit: bool = True) -> None:
         self.cur.execute(
-            f"UPDATE {self.tname} SET dm_val = :key WHERE dm_key = :val", {
+            f"UPDATE {self.tname} SET dm_val = :val WHERE dm_key = :key", {
                 "key": key,
                 "val": val
             })
@@ -74,3 +151,69 @@ class DurableMap:
                          {"key": key})
         if commit:
             self.commit()
+
+    def delete_many(self, keys: Iterable[str], commit: bool = True) -> None:
+        self.cur.executemany(f"DELETE FROM {self.tname} WHERE dm_key = ?",
+                             ((k,) for k in keys))
+        if commit:
+            self.commit()
+
+
+class CachedMap:
+    """
+    A DurableMap fully loaded into memory with one scan. Lookups are served
+    from memory; writes are kept dirty in memory and written back in one
+    batched transaction at `commit()` (the `commit` arguments of the writes are
+    accepted for compatibility but don't write through).
+    """
+
+    def __init__(self, dmap: DurableMap) -> None:
+        self.map = dmap
+        self.store = dmap.store
+        self.cache = dict(dmap.items())
+        self.dirty = set()
+
+    def close(self) -> None:
+        self.commit()
+        self.map.close()
+
+    def commit(self) -> None:
+        if not self.dirty:
+            return
+        puts = [(k, self.cache[k]) for k in self.dirty if k in self.cache]
+        deletes = [k for k in self.dirty if k not in self.cache]
+        with self.map.transaction():
+            self.map.put_many(puts, commit=False)
+            self.map.delete_many(deletes, commit=False)
+        self.dirty.clear()
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        # writes are deferred until `commit()` anyway
+        yield
+
+    def get(self, key: str) -> str:
+        return self.cache.get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        return {k: self.cache[k] for k in keys if k in self.cache}
+
+    def items(self) -> List[Tuple[str, str]]:
+        return list(self.cache.items())
+
+    def put(self, key: str, val: str = None, commit: bool = True) -> None:
+        self.cache[key] = val
+        self.dirty.add(key)
+
+    def put_many(self, items: Iterable[Tuple[str, Optional[str]]],
+                 commit: bool = True) -> None:
+        for key, val in items:
+            self.put(key, val)
+
+    def delete(self, key: str, commit: bool = True) -> None:
+        self.cache.pop(key, None)
+        self.dirty.add(key)
+
+    def delete_many(self, keys: Iterable[str], commit: bool = True) -> None:
+        for key in keys:
+            self.delete(key)
@@ -0,0 +1,69 @@
+"""
+A write-ahead journal of remote operations, kept in a DurableMap.
+"""
+import json
+from typing import Dict, List
+
+from .data import DurableMap
+
+
+class Journal:
+    """
+    Log an operation durably before it is sent, and mark it done once its
+    result is known, so that a crash in between leaves it "in doubt" and a
+    later run could find out whether it took effect.
+
+    Marking an operation done is committed at once as well, but the entry is
+    only dropped at `commit()`: the caller commits it together with the
+    states derived from the results (which may be written back lazily, e.g.
+    by a CachedMap), in one transaction of the same store.
+    Entries are dicts (serialized as JSON) with their key under "key"; a key
+    has at most one operation in flight.
+    """
+
+    def __init__(self, dmap: DurableMap) -> None:
+        self.map = dmap
+        self.store = dmap.store
+        # entries left by an earlier run are ordered before the new ones
+        self.seq = max((int(seq) + 1 for seq, _ in self.map.items()),
+                       default=0)
+        self.inflight = {}  # key -> sequence number of its entry
+        self.done = []
+
+    def transaction(self):
+        return self.store.transaction()
+
+    def log(self, key: str, entry: Dict) -> None:
+        """Log an operation of `key` (committed) before sending it."""
+        assert key not in self.inflight
+        seq = f"{self.seq:012d}"
+        self.seq += 1
+        self.map.put(seq, json.dumps({**entry, "key": key}))
+        self.inflight[key] = seq
+
+    def mark_done(self, key: str, entry: Dict) -> None:
+        """Replace the entry of `key` with the result of its operation."""
+        seq = self.inflight.pop(key)
+        self.map.put(seq, json.dumps({**entry, "key": key, "done": True}))
+        self.done.append(seq)
+
+    def mark_failed(self, key: str) -> None:
+        """Keep the entry of `key` in doubt; the operation may have applied."""
+        self.inflight.pop(key)
+
+    def items(self) -> List[Dict]:
+        """Return all entries in the order they were logged."""
+        return [json.loads(val) for _, val in sorted(self.map.items())]
+
+    def discard_all(self, commit: bool = True) -> None:
+        self.map.delete_many([seq for seq, _ in self.map.items()],
+                             commit=commit)
+        self.inflight.clear()
+        self.done.clear()
+
+    def commit(self) -> None:
+        """Drop the entries marked done; their results must be durable too."""
+        if self.done:
+            self.map.delete_many(self.done, commit=False)
+            self.done.clear()
+        self.store.commit()
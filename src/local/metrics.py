@@ -0,0 +1,141 @@
+"""
+Collect lightweight metrics of a run: time spent per phase, and calls,
+retries, throttling and latencies per API endpoint.
+"""
+import bisect
+import contextlib
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterator
+
+
+class Histogram:
+    """Latencies (in seconds) counted in fixed, roughly log-scaled buckets."""
+    BOUNDS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0,
+              5.0, 10.0, 20.0, 60.0]
+
+    def __init__(self) -> None:
+        # the last bucket is for anything beyond BOUNDS[-1]
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, val: float) -> None:
+        self.buckets[bisect.bisect_left(self.BOUNDS, val)] += 1
+        self.count += 1
+        self.total += val
+        self.min = min(self.min, val)
+        self.max = max(self.max, val)
+
+    def get_percentile(self, p: float) -> float:
+        """Return the upper bound of the bucket where the p-th percentile is."""
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n > 0:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict:
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.get_percentile(50),
+            "p90": self.get_percentile(90),
+            "p99": self.get_percentile(99),
+            "buckets": {f"<={b}": n for b, n in zip(self.BOUNDS, self.buckets)
+                        if n > 0},
+            "buckets_over": self.buckets[-1],
+        }
+
+
+class Metrics:
+    """
+    Thread-safe metrics of a run.
+
+    A phase could be entered by several threads at the same time (e.g. page
+    building of concurrent calendars), in which case their time adds up; a
+    phase could also be nested in another one (e.g. auth while validating
+    the config).
+    """
+
+    # counts always reported of each endpoint
+    COUNTS = ("calls", "retries", "throttled", "errors")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.phase_counts = Counter()
+        self.phase_seconds = defaultdict(float)
+        # endpoint -> counter of COUNTS (and anything else)
+        self.endpoint_counts = defaultdict(Counter)
+        self.endpoint_latencies = defaultdict(Histogram)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - begin)
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.phase_counts[name] += 1
+            self.phase_seconds[name] += seconds
+
+    def count(self, endpoint: str, key: str, n: int = 1) -> None:
+        with self.lock:
+            self.endpoint_counts[endpoint][key] += n
+
+    def observe(self, endpoint: str, seconds: float) -> None:
+        """Record a call to the endpoint that took `seconds`."""
+        with self.lock:
+            self.endpoint_counts[endpoint]["calls"] += 1
+            self.endpoint_latencies[endpoint].observe(seconds)
+
+    @contextlib.contextmanager
+    def call(self, endpoint: str) -> Iterator[None]:
+        """Time a call to the endpoint; count it as an error if it raises."""
+        begin = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.count(endpoint, "errors")
+            raise
+        finally:
+            self.observe(endpoint, time.perf_counter() - begin)
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                "phases": {
+                    name: {"count": self.phase_counts[name],
+                           "seconds": self.phase_seconds[name]}
+                    for name in self.phase_counts
+                },
+                "endpoints": {
+                    endpoint: {
+                        **{k: 0 for k in self.COUNTS},
+                        **counts,
+                        "latency": self.endpoint_latencies[endpoint].to_dict(),
+                    }
+                    for endpoint, counts in self.endpoint_counts.items()
+                },
+            }
+
+    def dump(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+# the metrics of this process
+metrics = Metrics()
@@ -0,0 +1,101 @@
+"""
+Ask a long-running process to do its work now, through a local Unix socket.
+"""
+import os
+import socket
+import threading
+from typing import List, Optional
+
+
+class TriggerServer:
+    """
+    Accept "sync" requests on a Unix socket. A request wakes up `wait`, and
+    its connection is kept open until it is answered with `reply`, so that the
+    requester could wait for the result.
+    """
+    REQUEST = b"sync\n"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.waiters = []
+        if os.path.exists(path):
+            # a socket file left by a process that has exited
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                    s.connect(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(path)
+            else:
+                raise RuntimeError(f"Another process is listening on {path}")
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen()
+        self.thread = threading.Thread(target=self._serve, name="trigger",
+                                       daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.reply(self.wait(0), "stopped")
+
+    def wait(self, timeout: float) -> List[socket.socket]:
+        """
+        Wait until some request comes or `timeout` seconds have passed; return
+        the connections of requests to answer (empty if timed out).
+        """
+        self.wake.wait(timeout)
+        with self.lock:
+            self.wake.clear()
+            waiters, self.waiters = self.waiters, []
+        return waiters
+
+    @staticmethod
+    def reply(waiters: List[socket.socket], msg: str) -> None:
+        for conn in waiters:
+            try:
+                conn.sendall(f"{msg}\n".encode("utf-8"))
+            except OSError:
+                pass  # the requester has given up
+            finally:
+                conn.close()
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:  # closed
+                return
+            try:
+                conn.settimeout(1.0)
+                req = conn.recv(len(self.REQUEST))
+                conn.settimeout(None)
+            except OSError:
+                conn.close()
+                continue
+            if req != self.REQUEST:
+                conn.close()
+                continue
+            with self.lock:
+                self.waiters.append(conn)
+                self.wake.set()
+
+
+def send_trigger(path: str, timeout: Optional[float] = None) -> str:
+    """Ask the process listening on `path` to sync now; return its answer."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall(TriggerServer.REQUEST)
+        res = b""
+        while True:
+            data = s.recv(1024)
+            if not data:
+                break
+            res += data
+    return res.decode("utf-8").strip()
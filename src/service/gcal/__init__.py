@@ -1,14 +1,21 @@
 import os.path
+import datetime
+import json
 import logging
-from typing import List, Optional
+from typing import Iterable, List, Optional
+from urllib.parse import urljoin
 
-from google.auth.transport.requests import Request
 from google.auth.exceptions import RefreshError
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from google_auth_httplib2 import Request
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.errors import HttpError
+import httplib2
+
+from local.metrics import metrics
 
 from .calendar import Calendar
+from .pool import HttpPool
 
 
 class GoogleCalendarService:
@@ -16,21 +23,50 @@ class GoogleCalendarService:
     # If modifying these scopes, delete the file token file.
     SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
     FIELDS = ["cal_name", "title", "time", "location", "description"]
+    # event resource fields that each of FIELDS reads from
+    FIELD_EVENT_KEYS = {
+        "cal_name": [],
+        "title": ["summary"],
+        "time": ["start", "end"],
+        "location": ["location"],
+        "description": ["description"],
+    }
+    # event resource fields that an Event always needs
+    EVENT_KEYS = ["id", "status", "kind", "start", "end"]
+    # the largest page size allowed (see Calendar for that of events)
+    MAX_CALENDARS_PER_PAGE = 250
 
     def __init__(self) -> None:
         # `creds` is a confusing name here. It actually means user's access
         # token, not the developer's credentials
         self.creds = None
+        self.token_path = None
         self.service = None
         self.is_auth = False
         self.cal_map = None
+        self.pool = None
+        self.api_endpoint = None
+        # where batch requests are sent, if not where the discovery document
+        # says (i.e. `api_endpoint` is overridden)
+        self.batch_uri = None
+        # the number of connections kept alive; could be changed before `auth`
+        self.pool_size = 2
+
+    def set_pool_size(self, pool_size: int) -> None:
+        assert not self.is_auth and pool_size > 0
+        self.pool_size = pool_size
 
-    def auth(self, creds_path: str, token_path: str) -> None:
+    def auth(self, creds_path: str, token_path: str,
+             discovery_path: Optional[str] = None,
+             api_endpoint: Optional[str] = None) -> None:
         """Perform authentications.
 
         Two files are involved:
         - credentials file: to prove to Google that the current application is SNOW.
         - token file: to ask the user to grant the access of the calendar data.
+        If `discovery_path` is given, the discovery document of the Calendar API
+        is cached there, so that later runs build the service from it directly.
+        `api_endpoint` overrides the servers to talk to (e.g. a local stand-in).
         """
         if self.is_auth:
             return
@@ -43,7 +79,9 @@ class GoogleCalendarService:
             if self.creds and self.creds.expired and self.creds.refresh_token:
                 logging.info("No valid token found. Will try to refresh.")
                 try:
-                    self.creds.refresh(Request())
+                    # refresh through httplib2 (which we use anyway), instead
+                    # of `requests`, which takes long to import
+                    self.creds.refresh(Request(httplib2.Http()))
                 except RefreshError:
                     logging.info(
                         "Fail to refresh token. User must retry login.")
@@ -51,15 +89,109 @@ class GoogleCalendarService:
                 logging.info("No valid token found. Please retry login.")
 
             if not self.creds or not self.creds.valid:
+                # only needed to login; it takes long to import
+                from google_auth_oauthlib.flow import InstalledAppFlow
                 flow = InstalledAppFlow.from_client_secrets_file(
                     creds_path, self.SCOPES)
                 self.creds = flow.run_local_server(port=0)
             # Save the credentials for the next run
             with open(token_path, 'w') as token:
                 token.write(self.creds.to_json())
-        self.service = build('calendar', 'v3', credentials=self.creds)
+        self.token_path = token_path
+        self.pool = HttpPool(self.creds, self.pool_size)
+        self.api_endpoint = api_endpoint
+        self.service = self.build_service(discovery_path, api_endpoint)
+        if api_endpoint is not None:
+            self.batch_uri = self.get_batch_uri(self.service._rootDesc,
+                                                api_endpoint)
         self.is_auth = True
 
+    def refresh_creds(self, margin: datetime.timedelta) -> bool:
+        """
+        Refresh the access token if it expires within `margin`, so that no
+        request has to wait for refreshing (e.g. in a long-running process).
+        Return whether it is refreshed.
+        """
+        assert self.is_auth
+        # `expiry` is a naive datetime in UTC
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        if self.creds.expiry is None or self.creds.expiry - now > margin:
+            return False
+        with metrics.phase("auth"):
+            self.creds.refresh(Request(httplib2.Http()))
+        with open(self.token_path, 'w') as token:
+            token.write(self.creds.to_json())
+        return True
+
+    @staticmethod
+    def get_batch_uri(root_desc: dict, api_endpoint: str) -> str:
+        """
+        Return the batch endpoint next to `api_endpoint`: googleapiclient
+        builds it from `rootUrl` of the discovery document, which
+        `api_endpoint` does not override.
+        """
+        service_path = root_desc.get('servicePath', '')
+        if service_path and api_endpoint.endswith(service_path):
+            root_url = api_endpoint[:-len(service_path)]
+        else:
+            root_url = urljoin(api_endpoint, '/')
+        return root_url + root_desc.get('batchPath', 'batch')
+
+    def build_service(self, discovery_path: Optional[str] = None,
+                      api_endpoint: Optional[str] = None):
+        client_options = None if api_endpoint is None else \
+            {'api_endpoint': api_endpoint}
+        if discovery_path is not None and os.path.isfile(discovery_path):
+            try:
+                with open(discovery_path, 'r') as f:
+                    return build_from_document(json.load(f), http=self.pool,
+                                               client_options=client_options)
+            except ValueError as e:  # e.g. a corrupted file
+                logging.warning(f"Fail to load discovery document "
+                                f"{discovery_path}: {e}")
+        service = build('calendar', 'v3', http=self.pool,
+                        client_options=client_options)
+        if discovery_path is not None:
+            path_tmp = f"{discovery_path}.tmp"
+            with open(path_tmp, 'w') as f:
+                json.dump(service._rootDesc, f)
+            os.replace(path_tmp, discovery_path)
+        return service
+
+    @classmethod
+    def get_event_fields(cls, fields: Iterable[str]) -> str:
+        """
+        Return the partial-response selector of an event resource that covers
+        the given FIELDS, so that the servers omit what SNOW never reads
+        (e.g. attendees, reminders).
+        """
+        keys = list(cls.EVENT_KEYS)
+        for field in fields:
+            keys.extend(cls.FIELD_EVENT_KEYS[field])
+        return ",".join(dict.fromkeys(keys))
+
+    @staticmethod
+    def is_sync_token_expired(e: Exception) -> bool:
+        """
+        Return whether a listing failed because its sync token is no longer
+        valid (HTTP 410 Gone), in which case the calendar must be listed in
+        full again.
+        """
+        if isinstance(e, HttpError):
+            return e.resp.status == 410
+        # httpx.HTTPStatusError of the async engine
+        res = getattr(e, "response", None)
+        return getattr(res, "status_code", None) == 410
+
+    def get_async_fetcher(self,
+                          pool_size: Optional[int] = None) -> 'AsyncEventFetcher':
+        # only needed by the async engine
+        from .aio import AsyncEventFetcher
+        assert self.is_auth
+        return AsyncEventFetcher(self.creds,
+                                 pool_size=pool_size or self.pool_size,
+                                 base_url=self.api_endpoint)
+
     def fetch_calendars(self) -> None:
         assert self.is_auth
         if self.cal_map is not None:
@@ -70,12 +202,17 @@ class GoogleCalendarService:
         # use page_token to iterate through the pages
         page_token = None
         while True:
-            cal_list_page = self.service.calendarList().list(
-                pageToken=page_token).execute()
+            with metrics.call("gcal.calendarlist.list"):
+                cal_list_page = self.service.calendarList().list(
+                    pageToken=page_token,
+                    maxResults=self.MAX_CALENDARS_PER_PAGE,
+                    fields="nextPageToken,items(id,summary,summaryOverride)"
+                ).execute()
             for cal_data in cal_list_page['items']:
-                cal = Calendar(self.service, cal_data)
+                cal = Calendar(self.service, cal_data,
+                               batch_uri=self.batch_uri)
                 self.cal_map[cal.name] = cal
-                logging.info(f"Get calendar: {cal.name}")
+                logging.info("Get calendar: %s", cal.name)
             page_token = cal_list_page.get('nextPageToken')
             if not page_token:
                 break
@@ -88,3 +225,11 @@ class GoogleCalendarService:
     def get_calendar(self, cal_name: str) -> Optional[Calendar]:
         self.fetch_calendars()
         return self.cal_map.get(cal_name)
+
+    def get_calendar_by_id(self, cal_id: str, cal_name: str) -> Calendar:
+        """Return a calendar of a known ID, without listing calendars."""
+        assert self.is_auth
+        if self.cal_map is not None and cal_name in self.cal_map:
+            return self.cal_map[cal_name]
+        return Calendar(self.service, {'id': cal_id, 'summary': cal_name},
+                        batch_uri=self.batch_uri)
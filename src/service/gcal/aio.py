@@ -0,0 +1,274 @@
+"""
+Fetch events through Google Calendar's REST endpoints with an
+httpx.AsyncClient, for the asyncio sync engine.
+"""
+import asyncio
+import datetime
+import logging
+from typing import AsyncIterator, Optional, Union
+from urllib.parse import quote
+
+import httplib2
+import httpx
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import Request
+
+from local.metrics import metrics
+
+from .calendar import Calendar, EventsPage, ListingWindows, WindowMerger
+from .event import Event
+
+
+class AsyncEventFetcher:
+    BASE_URL = "https://www.googleapis.com/calendar/v3"
+
+    def __init__(self,
+                 creds: Credentials,
+                 *,
+                 pool_size: int = 2,
+                 base_url: Optional[str] = None) -> None:
+        self.creds = creds
+        self.client = httpx.AsyncClient(
+            base_url=base_url or self.BASE_URL,
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=pool_size))
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    def get_headers(self) -> dict:
+        if not self.creds.valid:
+            # refreshing is rare and short, so it's fine to block the loop
+            self.creds.refresh(Request(httplib2.Http()))
+        return {"Authorization": f"Bearer {self.creds.token}"}
+
+    async def iter_events_pages(self,
+                                cal: Calendar,
+                                *,
+                                time_min: Optional[datetime.datetime] = None,
+                                sync_token: Optional[str] = None,
+                                fields: Optional[str] = None,
+                                page_token: Optional[str] = None,
+                                time_max: Optional[datetime.datetime] = None
+                                ) -> AsyncIterator[EventsPage]:
+        """The same as Calendar.iter_events_pages, but asynchronously."""
+        params = Calendar.get_list_params(time_min=time_min,
+                                          sync_token=sync_token,
+                                          fields=fields, time_max=time_max)
+        while True:
+            try:
+                res = await self.list_events(cal, params, page_token)
+            except httpx.HTTPStatusError as e:
+                if page_token is None or e.response.status_code not in (400, 410):
+                    raise
+                logging.warning("Page token of calendar %s is rejected (%s); "
+                                "will list from the first page", cal.name, e)
+                page_token = None
+                continue
+            events_page = Calendar.get_events_page(res)
+            yield events_page
+            page_token = events_page.next_page_token
+            if page_token is None:
+                return
+
+    async def get_sync_token(self,
+                             cal: Calendar,
+                             *,
+                             time_min: Optional[datetime.datetime] = None
+                             ) -> str:
+        """The same as Calendar.get_sync_token, but asynchronously."""
+        params = Calendar.get_list_params(time_min=time_min)
+        params["fields"] = "nextPageToken,nextSyncToken"
+        page_token = None
+        while True:
+            res = await self.list_events(cal, params, page_token)
+            page_token = res.get('nextPageToken')
+            if not page_token:
+                return res['nextSyncToken']
+
+    async def list_events(self, cal: Calendar, params: dict,
+                          page_token: Optional[str]) -> dict:
+        if page_token is not None:
+            params = dict(params, pageToken=page_token)
+        with metrics.call("gcal.events.list"):
+            res = await self.client.get(
+                f"/calendars/{quote(cal.id, safe='')}/events",
+                params=params, headers=self.get_headers())
+            res.raise_for_status()
+        return res.json()
+
+    def stream_events(self,
+                      cal: Calendar,
+                      *,
+                      time_min: Optional[datetime.datetime] = None,
+                      sync_token: Optional[str] = None,
+                      fields: Optional[str] = None,
+                      page_token: Optional[str] = None,
+                      max_pages: int = 2,
+                      num_windows: int = 1,
+                      max_total_pages: int = 16
+                      ) -> Union['AsyncEventStream', 'AsyncWindowedEventStream']:
+        """The same as Calendar.stream_events, but asynchronously."""
+        if num_windows > 1 and time_min is not None:
+            assert sync_token is None
+            return AsyncWindowedEventStream(self, cal, time_min=time_min,
+                                            fields=fields,
+                                            page_token=page_token,
+                                            max_pages=max_pages,
+                                            num_windows=num_windows,
+                                            max_total_pages=max_total_pages)
+        return AsyncEventStream(
+            self.iter_events_pages(cal, time_min=time_min,
+                                   sync_token=sync_token, fields=fields,
+                                   page_token=page_token),
+            max_pages=max_pages)
+
+
+class AsyncEventStream:
+    """
+    The same as EventStream, but the producer is a task on the running loop.
+    Iterate with `async for`, within `async with`.
+    """
+    _DONE = object()
+
+    def __init__(self,
+                 pages: AsyncIterator[EventsPage],
+                 *,
+                 max_pages: int = 2) -> None:
+        assert max_pages > 0
+        self.pages = pages
+        self.queue = asyncio.Queue(maxsize=max_pages)
+        self.task = None
+        self.next_sync_token = None
+
+    async def __aenter__(self) -> 'AsyncEventStream':
+        self.task = asyncio.ensure_future(self._produce())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def __aiter__(self) -> AsyncIterator[Event]:
+        async for page in self.iter_pages():
+            for event in page.events:
+                yield event
+
+    async def iter_pages(self) -> AsyncIterator[EventsPage]:
+        while True:
+            with metrics.phase("listing"):
+                item = await self.queue.get()
+            if item is self._DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            if item.next_sync_token is not None:
+                self.next_sync_token = item.next_sync_token
+            yield item
+
+    async def _produce(self) -> None:
+        try:
+            async for item in self.pages:
+                await self.queue.put(item)
+            await self.queue.put(self._DONE)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self.queue.put(e)
+
+
+class AsyncWindowedEventStream:
+    """
+    The same as WindowedEventStream, but the sync token is obtained (for a
+    new listing) when entered, and the windows are fetched by tasks.
+    """
+
+    def __init__(self,
+                 fetcher: AsyncEventFetcher,
+                 cal: Calendar,
+                 *,
+                 time_min: datetime.datetime,
+                 fields: Optional[str],
+                 page_token: Optional[str],
+                 max_pages: int,
+                 num_windows: int,
+                 max_total_pages: int) -> None:
+        self.fetcher = fetcher
+        self.cal = cal
+        self.time_min = time_min
+        self.fields = fields
+        self.page_token = page_token
+        self.max_pages = max_pages
+        self.num_windows = num_windows
+        self.max_total_pages = max_total_pages
+        self.windows = None
+        self.merger = None
+        self.cond = asyncio.Condition()
+        self.streams = []
+
+    @property
+    def next_sync_token(self) -> Optional[str]:
+        return self.merger.next_sync_token
+
+    async def __aenter__(self) -> 'AsyncWindowedEventStream':
+        if self.page_token is not None:
+            self.windows = ListingWindows.from_page_token(self.page_token)
+        else:
+            with metrics.phase("listing"):
+                self.windows = ListingWindows.split(
+                    await self.fetcher.get_sync_token(
+                        self.cal, time_min=self.time_min),
+                    self.time_min, self.num_windows)
+        self.merger = WindowMerger(self.windows, self.max_pages,
+                                   self.max_total_pages)
+        for window, begin, end, token in self.windows.get_pending():
+            stream = AsyncEventStream(
+                self._iter_pages_in_budget(
+                    window,
+                    self.fetcher.iter_events_pages(self.cal, time_min=begin,
+                                                   time_max=end,
+                                                   fields=self.fields,
+                                                   page_token=token)),
+                max_pages=self.max_pages + self.max_total_pages)
+            self.streams.append(await stream.__aenter__())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        for stream in self.streams:
+            await stream.__aexit__(exc_type, exc_val, exc_tb)
+
+    async def __aiter__(self) -> AsyncIterator[Event]:
+        async for page in self.iter_pages():
+            for event in page.events:
+                yield event
+
+    async def iter_pages(self) -> AsyncIterator[EventsPage]:
+        for window, stream in enumerate(self.streams, self.windows.window):
+            async with self.cond:
+                self.merger.start_window(window)
+                self.cond.notify_all()
+            async for page in stream.iter_pages():
+                async with self.cond:
+                    page = self.merger.merge(window, page)
+                    self.cond.notify_all()
+                yield page
+
+    async def _iter_pages_in_budget(self, window: int,
+                                    pages: AsyncIterator[EventsPage]
+                                    ) -> AsyncIterator[EventsPage]:
+        budget = self.merger.budget
+        while True:
+            async with self.cond:
+                await self.cond.wait_for(lambda: budget.can_take(window))
+                budget.take(window)
+            try:
+                page = await pages.__anext__()
+            except StopAsyncIteration:
+                async with self.cond:
+                    budget.give(window)
+                    self.cond.notify_all()
+                return
+            yield page
@@ -1,20 +1,207 @@
 import pprint
-from typing import Dict, Any, Optional
+from collections import Counter, OrderedDict
+from typing import (Dict, Any, Iterable, Iterator, List, NamedTuple, Optional,
+                    Set, Tuple, Union)
+import json
 import logging
 import datetime
+import queue
+import threading
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+
+from local.metrics import metrics
 
 from .event import Event
 
 
+class EventsPage(NamedTuple):
+    """
+    A page of listed events. `next_page_token` resumes the listing after this
+    page (None if it is the last one); `next_sync_token` only comes with the
+    last page.
+    """
+    events: List[Event]
+    next_page_token: Optional[str]
+    next_sync_token: Optional[str]
+
+
+class ListingWindows:
+    """
+    A full listing split into time windows, which could be listed
+    concurrently. Adjacent windows overlap by `OVERLAP`, so that no event is
+    missed at their boundaries; events in more than one window (e.g. those
+    spanning a boundary) should be yielded once.
+
+    The sync token is obtained before any window is listed, so that changes
+    made while listing are still picked up by the next incremental listing.
+    It is kept with the windows and where to resume the listing in a page
+    token of its own (see `get_page_token`).
+    """
+    OVERLAP = datetime.timedelta(seconds=1)
+
+    def __init__(self,
+                 sync_token: str,
+                 windows: List[Tuple[datetime.datetime,
+                                     Optional[datetime.datetime]]],
+                 window: int = 0,
+                 page_token: Optional[str] = None) -> None:
+        self.sync_token = sync_token
+        self.windows = windows
+        # the window and its page to list from
+        self.window = window
+        self.page_token = page_token
+
+    @classmethod
+    def split(cls,
+              sync_token: str,
+              time_min: datetime.datetime,
+              num_windows: int) -> 'ListingWindows':
+        """
+        Split the time since `time_min` into `num_windows` windows: windows of
+        equal length up to now (where most events of a long history are),
+        and the last one for all events after.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if num_windows <= 1 or time_min >= now:
+            return cls(sync_token, [(time_min, None)])
+        step = (now - time_min) / (num_windows - 1)
+        bounds = [time_min + step * i for i in range(num_windows)]
+        windows = [(begin, end + cls.OVERLAP)
+                   for begin, end in zip(bounds, bounds[1:])]
+        windows.append((bounds[-1], None))
+        return cls(sync_token, windows)
+
+    @classmethod
+    def from_page_token(cls, page_token: str) -> 'ListingWindows':
+        state = json.loads(page_token)
+        windows = [(datetime.datetime.fromisoformat(begin),
+                    None if end is None else datetime.datetime.fromisoformat(end))
+                   for begin, end in state["windows"]]
+        return cls(state["sync_token"], windows, state["window"],
+                   state["page_token"])
+
+    def get_page_token(self, window: int, page_token: Optional[str]) -> str:
+        """Return a page token that resumes from the page of the window."""
+        return json.dumps({
+            "sync_token": self.sync_token,
+            "windows": [[begin.isoformat(),
+                         None if end is None else end.isoformat()]
+                        for begin, end in self.windows],
+            "window": window,
+            "page_token": page_token,
+        })
+
+    def get_pending(self) -> List[Tuple[int, datetime.datetime,
+                                        Optional[datetime.datetime],
+                                        Optional[str]]]:
+        """Return (window, time_min, time_max, page_token) to list."""
+        return [(i, begin, end, self.page_token if i == self.window else None)
+                for i, (begin, end) in enumerate(self.windows)
+                if i >= self.window]
+
+    def merge(self, window: int, page: EventsPage,
+              seen: Set[str]) -> EventsPage:
+        """
+        Return a page of the window as a page of the whole listing, without
+        events in `seen` (listed by earlier windows).
+        """
+        events = [event for event in page.events if event.id not in seen]
+        seen.update(event.id for event in events)
+        if page.next_page_token is not None:
+            return EventsPage(events,
+                              self.get_page_token(window, page.next_page_token),
+                              None)
+        if window + 1 < len(self.windows):
+            return EventsPage(events, self.get_page_token(window + 1, None),
+                              None)
+        return EventsPage(events, None, self.sync_token)
+
+
+class PageBudget:
+    """
+    Count the pages that windows have fetched but are not consumed yet. The
+    window being consumed may have `max_pages` of them, like an EventStream;
+    the windows after it may have `max_total_pages` in total, so that they
+    are fetched regardless of the order they are consumed in.
+    """
+
+    def __init__(self, window: int, max_pages: int,
+                 max_total_pages: int) -> None:
+        # the window being consumed
+        self.window = window
+        self.max_pages = max_pages
+        self.max_total_pages = max_total_pages
+        self.num_pages = Counter()
+        self.num_total_pages = 0
+
+    def can_take(self, window: int) -> bool:
+        if window == self.window:
+            return self.num_pages[window] < self.max_pages
+        return (self.num_total_pages - self.num_pages[self.window]
+                < self.max_total_pages)
+
+    def take(self, window: int) -> None:
+        self.num_pages[window] += 1
+        self.num_total_pages += 1
+
+    def give(self, window: int) -> None:
+        self.num_pages[window] -= 1
+        self.num_total_pages -= 1
+
+
+class EventCache:
+    """
+    Keep the most recently used events, up to `max_size` of them (none if 0),
+    so that a long-running or huge sync has a bounded memory footprint.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        assert max_size >= 0
+        self.max_size = max_size
+        self.events = OrderedDict()
+
+    def __contains__(self, event_id: str) -> bool:
+        return event_id in self.events
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __getitem__(self, event_id: str) -> Event:
+        event = self.events[event_id]
+        self.events.move_to_end(event_id)
+        return event
+
+    def __setitem__(self, event_id: str, event: Event) -> None:
+        if self.max_size == 0:
+            return
+        self.events[event_id] = event
+        self.events.move_to_end(event_id)
+        if len(self.events) > self.max_size:
+            self.events.popitem(last=False)
+
+
 class Calendar:
+    # Google allows up to 50 calls in a batch request
+    BATCH_SIZE = 50
+    # the largest page size of listing events
+    MAX_EVENTS_PER_PAGE = 2500
+    # the number of events kept in `events_cache`
+    EVENTS_CACHE_SIZE = 4096
+
     def __init__(self,
                  service: 'GoogleCalendarService',
-                 data: Dict) -> None:
+                 data: Dict,
+                 *,
+                 batch_uri: Optional[str] = None) -> None:
         self.service = service
+        # None to send batch requests where the discovery document says
+        self.batch_uri = batch_uri
         self.id = data['id']
         self.summary = data['summaryOverride'] if 'summaryOverride' in data else data['summary']
         self.data = data
-        self.events_cache = {}
+        self.events_cache = EventCache(self.EVENTS_CACHE_SIZE)
 
     def __str__(self) -> str:
         return f"{self.id}: {pprint.pformat(self.data)}"
@@ -26,44 +213,399 @@ class Calendar:
     def name(self) -> str:
         return self.summary
 
+    @classmethod
+    def get_list_params(cls,
+                        *,
+                        time_min: Optional[datetime.datetime] = None,
+                        sync_token: Optional[str] = None,
+                        fields: Optional[str] = None,
+                        time_max: Optional[datetime.datetime] = None
+                        ) -> Dict[str, Any]:
+        """
+        Return the parameters of listing events (see `iter_events_pages`),
+        except the calendar and the page token.
+        """
+        # these two fields cannot be provided together
+        assert time_min is None or sync_token is None
+        params = {"singleEvents": "true", "showDeleted": "true",
+                  "maxResults": cls.MAX_EVENTS_PER_PAGE}
+        if fields is not None:
+            params["fields"] = f"nextPageToken,nextSyncToken,items({fields})"
+        if sync_token is not None:
+            params["syncToken"] = sync_token
+        if time_min is not None:
+            params["timeMin"] = time_min.isoformat()
+        if time_max is not None:
+            params["timeMax"] = time_max.isoformat()
+        return params
+
+    @staticmethod
+    def get_events_page(res: Dict) -> EventsPage:
+        """Return the page of events in a response of listing events."""
+        events = []
+        for event_data in res['items']:
+            event = Event(event_data)
+            events.append(event)
+            logging.info("Get event: %s", event.name)
+        page_token = res.get('nextPageToken')
+        if not page_token:
+            return EventsPage(events, None, res.get('nextSyncToken'))
+        return EventsPage(events, page_token, None)
+
+    def iter_events_pages(self,
+                          *,
+                          time_min: Optional[datetime.datetime] = None,
+                          sync_token: Optional[str] = None,
+                          fields: Optional[str] = None,
+                          page_token: Optional[str] = None,
+                          time_max: Optional[datetime.datetime] = None
+                          ) -> Iterator[EventsPage]:
+        """
+        Yield events within a given calendar page by page.
+        If `fields` is given, only these fields of events are returned (see
+        GoogleCalendarService.get_event_fields).
+        If `page_token` is given (e.g. from an interrupted listing with the
+        same arguments), the listing resumes from that page; if the servers
+        no longer accept it, the listing starts over.
+        If `time_max` is given, only events that start before it are listed,
+        and the last page has no sync token.
+        """
+        params = self.get_list_params(time_min=time_min,
+                                      sync_token=sync_token, fields=fields,
+                                      time_max=time_max)
+        while True:
+            try:
+                with metrics.call("gcal.events.list"):
+                    res = self.service.events().list(
+                        calendarId=self.id, pageToken=page_token,
+                        **params).execute()
+            except HttpError as e:
+                if page_token is None or e.resp.status not in (400, 410):
+                    raise
+                logging.warning("Page token of calendar %s is rejected (%s); "
+                                "will list from the first page", self.name, e)
+                page_token = None
+                continue
+            events_page = self.get_events_page(res)
+            yield events_page
+            page_token = events_page.next_page_token
+            if page_token is None:
+                return
+
+    def get_sync_token(self,
+                       *,
+                       time_min: Optional[datetime.datetime] = None) -> str:
+        """
+        Return the sync token of a full listing since `time_min`; the pages
+        are walked through without any event in them, but Google may take
+        about as long for them as with their events.
+        """
+        params = self.get_list_params(time_min=time_min)
+        params["fields"] = "nextPageToken,nextSyncToken"
+        page_token = None
+        while True:
+            with metrics.call("gcal.events.list"):
+                res = self.service.events().list(
+                    calendarId=self.id, pageToken=page_token,
+                    **params).execute()
+            page_token = res.get('nextPageToken')
+            if not page_token:
+                return res['nextSyncToken']
+
     def list_events_id(self,
                        *,
                        time_min: Optional[datetime.datetime] = None,
-                       sync_token: Optional[str] = None):
-        """Return all events within a given calendar."""
-        # these two fields cannot be provided together
-        assert time_min is None or sync_token is None
+                       sync_token: Optional[str] = None,
+                       fields: Optional[str] = None):
+        """
+        Return all events within a given calendar. Only the most recent
+        `EVENTS_CACHE_SIZE` of them are kept in `events_cache`; use
+        `stream_events` to go through a huge calendar.
+        """
         events_id_list = []
-        page_token = None
         next_sync_token = None
-        while True:
-            events_page = self.service.events().list(
-                calendarId=self.id,
-                pageToken=page_token,
-                syncToken=sync_token,
-                timeMin=time_min.isoformat() if time_min is not None else None,
-                singleEvents='true',
-                showDeleted='true').execute()
-            for event_data in events_page['items']:
-                event = Event(self.service, event_data)
+        for events, _, next_sync_token in self.iter_events_pages(
+                time_min=time_min, sync_token=sync_token, fields=fields):
+            for event in events:
                 self.events_cache[event.id] = event
                 events_id_list.append(event.id)
-                logging.info(f"Get event: {event.name}")
-            page_token = events_page.get('nextPageToken')
-            if not page_token:
-                next_sync_token = events_page.get('nextSyncToken')
-                break
         return events_id_list, next_sync_token
 
+    def stream_events(self,
+                      *,
+                      time_min: Optional[datetime.datetime] = None,
+                      sync_token: Optional[str] = None,
+                      fields: Optional[str] = None,
+                      page_token: Optional[str] = None,
+                      max_pages: int = 2,
+                      num_windows: int = 1,
+                      max_total_pages: int = 16
+                      ) -> Union['EventStream', 'WindowedEventStream']:
+        """
+        Fetch events in the background while the caller consumes them. Unlike
+        `list_events_id`, the events are not kept in `events_cache`.
+        A full listing (with `time_min`) is split into `num_windows` time
+        windows fetched concurrently, if more than one (see ListingWindows);
+        those after the one being consumed may fetch up to `max_total_pages`
+        pages in total ahead of the caller.
+        """
+        if num_windows > 1 and time_min is not None:
+            assert sync_token is None
+            if page_token is not None:
+                windows = ListingWindows.from_page_token(page_token)
+            else:
+                with metrics.phase("listing"):
+                    windows = ListingWindows.split(
+                        self.get_sync_token(time_min=time_min), time_min,
+                        num_windows)
+            return WindowedEventStream(
+                windows,
+                [self.iter_events_pages(time_min=begin, time_max=end,
+                                        fields=fields, page_token=token)
+                 for _, begin, end, token in windows.get_pending()],
+                max_pages=max_pages, max_total_pages=max_total_pages)
+        return EventStream(self.iter_events_pages(time_min=time_min,
+                                                  sync_token=sync_token,
+                                                  fields=fields,
+                                                  page_token=page_token),
+                           max_pages=max_pages)
+
     def get_event(self, event_id: str) -> Event:
         if event_id in self.events_cache:
             return self.events_cache[event_id]
 
         logging.warning(
             f"Event {event_id} not found in the local cache; will query servers")
-        event_data = self.service.events().get(
-            calendarId=self.id, eventId=event_id).execute()
-        event = Event(self.service, event_data)
+        with metrics.call("gcal.events.get"):
+            event_data = self.service.events().get(
+                calendarId=self.id, eventId=event_id).execute()
+        event = Event(event_data)
         self.events_cache[event.id] = event
-        logging.info(f"Get event: {event.name}")
+        logging.info("Get event: %s", event.name)
         return event
+
+    def get_events(self, event_ids: Iterable[str],
+                   fields: Optional[str] = None) -> Dict[str, Event]:
+        """
+        Return the events of the given ids. Those not in the local cache are
+        fetched with batch requests, each with up to `BATCH_SIZE` calls.
+        Events that no longer exist on the servers are omitted.
+        """
+        events = {}
+        missing = []
+        for eid in event_ids:
+            if eid in self.events_cache:
+                events[eid] = self.events_cache[eid]
+            elif eid not in events:
+                missing.append(eid)
+        missing = list(dict.fromkeys(missing))
+        if not missing:
+            return events
+        logging.info(f"{len(missing)} events not found in the local cache; "
+                     "will query servers in batches")
+
+        errors = []
+
+        def callback(request_id: str, event_data: Dict,
+                     exception: Optional[HttpError]) -> None:
+            if exception is not None:
+                if exception.resp.status in (404, 410):
+                    logging.warning(f"Event {request_id} not found on servers")
+                else:
+                    errors.append(exception)
+                return
+            event = Event(event_data)
+            self.events_cache[event.id] = event
+            events[event.id] = event
+            logging.info("Get event: %s", event.name)
+
+        for i in range(0, len(missing), self.BATCH_SIZE):
+            if self.batch_uri is None:
+                batch = self.service.new_batch_http_request(callback=callback)
+            else:
+                batch = BatchHttpRequest(callback=callback,
+                                         batch_uri=self.batch_uri)
+            for eid in missing[i:i + self.BATCH_SIZE]:
+                batch.add(self.service.events().get(calendarId=self.id,
+                                                    eventId=eid,
+                                                    fields=fields),
+                          request_id=eid)
+            with metrics.call("gcal.batch"):
+                batch.execute()
+            metrics.count("gcal.batch", "batched_calls",
+                          len(missing[i:i + self.BATCH_SIZE]))
+            if errors:
+                raise errors[0]
+        return events
+
+
+class EventStream:
+    """
+    Run a generator of event pages in a producer thread, and iterate over its
+    events. At most `max_pages` fetched pages wait to be consumed, so the
+    producer is throttled by the consumer and the memory usage is bounded
+    regardless of the calendar size. `next_sync_token` is available after all
+    events have been consumed.
+    """
+    _DONE = object()
+
+    def __init__(self,
+                 pages: Iterator[EventsPage],
+                 *,
+                 max_pages: int = 2) -> None:
+        assert max_pages > 0
+        self.pages = pages
+        self.queue = queue.Queue(maxsize=max_pages)
+        self.stopped = threading.Event()
+        self.next_sync_token = None
+        self.thread = threading.Thread(target=self._produce,
+                                       name="event-stream", daemon=True)
+        self.thread.start()
+
+    def __enter__(self) -> 'EventStream':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[Event]:
+        for page in self.iter_pages():
+            yield from page.events
+
+    def iter_pages(self) -> Iterator[EventsPage]:
+        """Iterate over pages, e.g. to checkpoint at page boundaries."""
+        while True:
+            # time that the consumer waits for Google
+            with metrics.phase("listing"):
+                item = self.queue.get()
+            if item is self._DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            if item.next_sync_token is not None:
+                self.next_sync_token = item.next_sync_token
+            yield item
+
+    def close(self) -> None:
+        """Stop the producer (e.g. if the consumer gives up halfway)."""
+        self.stopped.set()
+        # unblock the producer if it is waiting for room in the queue
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.thread.join()
+
+    def _produce(self) -> None:
+        try:
+            for item in self.pages:
+                if self.stopped.is_set():
+                    return
+                self.queue.put(item)
+            self.queue.put(self._DONE)
+        except Exception as e:
+            self.queue.put(e)
+
+
+class WindowMerger:
+    """
+    Merge the pages of windows, fetched within a PageBudget, into pages of
+    the whole listing, for WindowedEventStream and its async counterpart.
+    Callers must hold the lock (or condition) guarding the budget.
+    """
+
+    def __init__(self,
+                 windows: ListingWindows,
+                 max_pages: int,
+                 max_total_pages: int) -> None:
+        self.windows = windows
+        self.budget = PageBudget(windows.window, max_pages, max_total_pages)
+        # events listed by earlier windows
+        self.seen = set()
+        self.next_sync_token = None
+
+    def start_window(self, window: int) -> None:
+        self.budget.window = window
+
+    def merge(self, window: int, page: EventsPage) -> EventsPage:
+        self.budget.give(window)
+        page = self.windows.merge(window, page, self.seen)
+        if page.next_sync_token is not None:
+            self.next_sync_token = page.next_sync_token
+        return page
+
+
+class WindowedEventStream:
+    """
+    The same interface as EventStream, over the EventStreams of windows that
+    are fetched concurrently (within a PageBudget); their pages are yielded
+    one window after another, so that a page token resumes the whole listing.
+    """
+
+    def __init__(self,
+                 windows: ListingWindows,
+                 pages: List[Iterator[EventsPage]],
+                 *,
+                 max_pages: int = 2,
+                 max_total_pages: int = 16) -> None:
+        self.windows = windows
+        self.merger = WindowMerger(windows, max_pages, max_total_pages)
+        self.cond = threading.Condition()
+        self.closed = False
+        # of the pending windows; their queues are bounded by the budget
+        self.streams = [
+            EventStream(self._iter_pages_in_budget(window, window_pages),
+                        max_pages=max_pages + max_total_pages)
+            for window, window_pages in enumerate(pages, windows.window)]
+
+    @property
+    def next_sync_token(self) -> Optional[str]:
+        return self.merger.next_sync_token
+
+    def __enter__(self) -> 'WindowedEventStream':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[Event]:
+        for page in self.iter_pages():
+            yield from page.events
+
+    def iter_pages(self) -> Iterator[EventsPage]:
+        for window, stream in enumerate(self.streams, self.windows.window):
+            with self.cond:
+                self.merger.start_window(window)
+                self.cond.notify_all()
+            for page in stream.iter_pages():
+                with self.cond:
+                    page = self.merger.merge(window, page)
+                    self.cond.notify_all()
+                yield page
+
+    def close(self) -> None:
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for stream in self.streams:
+            stream.close()
+
+    def _iter_pages_in_budget(self, window: int,
+                              pages: Iterator[EventsPage]
+                              ) -> Iterator[EventsPage]:
+        budget = self.merger.budget
+        while True:
+            with self.cond:
+                self.cond.wait_for(
+                    lambda: self.closed or budget.can_take(window))
+                if self.closed:
+                    return
+                budget.take(window)
+            page = next(pages, None)
+            if page is None:
+                with self.cond:
+                    budget.give(window)
+                    self.cond.notify_all()
+                return
+            yield page
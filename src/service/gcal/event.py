@@ -1,18 +1,63 @@
-from typing import Dict, Optional, Any
+from typing import Dict, Optional, Any, Tuple, Union
+import functools
 import pprint
 import datetime
-import dateutil.parser
-import dateutil.tz
+
+
+@functools.lru_cache(maxsize=None)
+def get_tz(name: str) -> Optional[datetime.tzinfo]:
+    # dateutil takes a while to import; only import it when needed
+    import dateutil.tz
+    return dateutil.tz.gettz(name)
+
+
+def parse_datetime(s: str) -> datetime.datetime:
+    """
+    Parse an RFC3339 timestamp, e.g. "2022-01-01T10:00:00-05:00". Google's
+    output is valid for `fromisoformat` (except a trailing "Z" before Python
+    3.11), which is much faster than dateutil; dateutil is only the fallback.
+    """
+    if s.endswith('Z'):
+        s = s[:-1] + '+00:00'
+    try:
+        return datetime.datetime.fromisoformat(s)
+    except ValueError:
+        import dateutil.parser
+        return dateutil.parser.isoparse(s)
+
+
+def parse_time(data: Dict) -> Tuple[Union[datetime.datetime, datetime.date], bool]:
+    """
+    Parse the start or end of an event, and return it with whether it is a
+    date (i.e. all-day).
+    """
+    if 'dateTime' in data:
+        dt = parse_datetime(data['dateTime'])
+        if dt.tzinfo is None and 'timeZone' in data:
+            dt = dt.replace(tzinfo=get_tz(data['timeZone']))
+        return dt, False
+    assert 'date' in data
+    return datetime.date.fromisoformat(data['date']), True
 
 
 class Event:
-    def __init__(self,
-                 service: 'GoogleCalendarService',
-                 data: Dict) -> None:
-        self.service = service
+    """
+    An event with only the fields SNOW reads. Busy calendars could have many
+    thousands of events in flight, so the raw resource is dropped unless
+    `keep_raw` is set, and attributes are slotted (no per-event __dict__).
+    """
+    __slots__ = ('id', 'status', 'is_all_day', 'start', 'end', 'summary',
+                 'location', 'description', 'raw')
+    # keys of the raw resource that are kept as attributes
+    KEYS = ('id', 'status', 'summary', 'location', 'description')
+
+    def __init__(self, data: Dict, *, keep_raw: bool = False) -> None:
         self.id = data['id']
         self.status = data['status']  # "confirmed" / "tentative" / "cancelled"
-        self.data = data
+        self.summary = data.get('summary')
+        self.location = data.get('location')
+        self.description = data.get('description')
+        self.raw = data if keep_raw else None
         self.is_all_day = False
         self.start = None
         self.end = None
@@ -21,35 +66,28 @@ class Event:
             or data['status'] == "cancelled"
         assert data['kind'] == "calendar#event"
 
-        if 'dateTime' in data['start']:
-            self.start = dateutil.parser.isoparse(data['start']['dateTime'])
-            if self.start.tzinfo is None and 'timeZone' in data['start']:
-                self.start.tzinfo = self.start.astimezone(
-                    dateutil.tz.gettz(data['start']['timeZone']))
-        else:
-            assert 'date' in data['start']
-            self.start = datetime.date.fromisoformat(data['start']['date'])
-            self.is_all_day = True
-
-        if 'end' not in data:
+        if 'start' not in data:
+            # a cancelled event may come with its id and status only
+            assert self.is_deleted
             return
-
-        if 'dateTime' in data['start']:
-            self.end = dateutil.parser.isoparse(data['end']['dateTime'])
-            if self.end.tzinfo is None and 'timeZone' in data['end']:
-                self.end.tzinfo = self.end.astimezone(
-                    dateutil.tz.gettz(data['end']['timeZone']))
-        else:
-            assert 'date' in data['end']
-            self.end = datetime.date.fromisoformat(data['end']['date'])
-            assert self.is_all_day
+        self.start, self.is_all_day = parse_time(data['start'])
+        if 'end' in data:
+            self.end, is_all_day = parse_time(data['end'])
+            assert is_all_day == self.is_all_day
 
     def __str__(self) -> str:
-        return f"{self.id}: {pprint.pformat(self.data)}"
+        data = self.raw if self.raw is not None else \
+            {k: getattr(self, k) for k in self.__slots__ if k != 'raw'}
+        return f"{self.id}: {pprint.pformat(data)}"
 
     def __getitem__(self, name: str) -> Optional[Any]:
-        return self.data.get(name)
-    
+        """Return a field of the resource, e.g. event["summary"]."""
+        if name in self.KEYS:
+            return getattr(self, name)
+        if self.raw is not None:
+            return self.raw.get(name)
+        return None
+
     @property
     def name(self) -> str:
         return self.id
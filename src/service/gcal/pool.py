@@ -0,0 +1,57 @@
+"""
+A thread-safe pool of keep-alive connections for googleapiclient.
+"""
+import queue
+import threading
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+
+
+class HttpPool:
+    """
+    An `http` object for googleapiclient that could be shared by threads.
+
+    httplib2.Http is not thread-safe, so each request checks out one of at most
+    `size` AuthorizedHttp (each keeps its connections alive across requests)
+    and returns it when done; a request blocks if all of them are in use.
+    """
+
+    def __init__(self, creds: Credentials, size: int) -> None:
+        assert size > 0
+        # googleapiclient reads it to refresh and apply credentials to batches
+        self.credentials = creds
+        self.size = size
+        self.num_created = 0
+        self.lock = threading.Lock()
+        self.idle = queue.LifoQueue()  # reuse the most recently warmed one
+
+    def request(self, *args, **kwargs):
+        http = self.checkout()
+        try:
+            return http.request(*args, **kwargs)
+        finally:
+            self.idle.put(http)
+
+    def checkout(self) -> AuthorizedHttp:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            can_create = self.num_created < self.size
+            if can_create:
+                self.num_created += 1
+        if can_create:
+            return AuthorizedHttp(self.credentials, http=httplib2.Http())
+        return self.idle.get()
+
+    def close(self) -> None:
+        while True:
+            try:
+                http = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            http.close()
+            self.num_created -= 1
@@ -1,22 +1,97 @@
 from notion_client import Client
+from notion_client.errors import APIResponseError
 from typing import List, Optional
+import importlib.util
+import logging
+
+import httpx
 
 from .database import Database
+from .ratelimit import RateLimiter
 
 
 class NotionService:
+    # the API version that databases are searched, retrieved and queried
+    # with; later versions moved their schemas and queries to data sources
+    NOTION_VERSION = "2022-06-28"
+
     def __init__(self) -> None:
+        self.token = None
+        self.base_url = None
         self.client = None
+        self.async_client = None
         self.is_auth = False
         self.db_map = None
         self.active_db = None
+        # one limiter for all requests, since Notion's limit is per integration
+        self.limiter_kwargs = {}
+        self.limiter = RateLimiter()
+        self.async_limiter = None
+        # the number of connections kept alive; could be changed before `auth`
+        self.pool_size = self.limiter.max_concurrency
+
+    def set_rate_limit(self, **kwargs) -> None:
+        """Change the limits of requests (see RateLimiter), e.g. for a stand-in."""
+        assert not self.is_auth
+        self.limiter_kwargs = kwargs
+        self.limiter = RateLimiter(**kwargs)
+        self.pool_size = min(self.pool_size, self.limiter.max_concurrency)
+
+    def set_pool_size(self, pool_size: int) -> None:
+        assert not self.is_auth and pool_size > 0
+        # the limiter never lets more requests be in flight anyway
+        self.pool_size = min(pool_size, self.limiter.max_concurrency)
 
-    def auth(self, token_path) -> None:
+    def get_http_client_kwargs(self) -> dict:
+        # multiplex requests on one connection if HTTP/2 is installed (with
+        # `pip install httpx[http2]`)
+        return dict(limits=httpx.Limits(max_connections=self.pool_size,
+                                        max_keepalive_connections=self.pool_size),
+                    http2=importlib.util.find_spec('h2') is not None)
+
+    def get_client_options(self) -> dict:
+        # retries are left to `limiter`, which also adapts to throttling
+        options = dict(auth=self.token, notion_version=self.NOTION_VERSION,
+                       retry=False)
+        if self.base_url is not None:
+            options['base_url'] = self.base_url
+        return options
+
+    def auth(self, token_path, base_url: Optional[str] = None) -> None:
+        """`base_url` overrides the servers to talk to (e.g. a local stand-in)."""
         with open(token_path, 'r') as f:
             token = f.read()
-        self.client = Client(auth=token.strip())
+        self.token = token.strip()
+        self.base_url = base_url
+        self.client = Client(client=httpx.Client(**self.get_http_client_kwargs()),
+                             **self.get_client_options())
         self.is_auth = True
 
+    def get_async_database(self, db: Database) -> 'AsyncDatabase':
+        """
+        Return a handle to send page requests of `db` through an AsyncClient.
+        All handles share one AsyncClient and one AsyncRateLimiter.
+        """
+        # asyncio is only needed by the async engine; import it lazily to
+        # keep the startup of the default engine fast
+        from notion_client import AsyncClient
+        from .aio import AsyncDatabase, AsyncRateLimiter
+
+        assert self.is_auth
+        if self.async_client is None:
+            self.async_client = AsyncClient(
+                client=httpx.AsyncClient(**self.get_http_client_kwargs()),
+                **self.get_client_options())
+            self.async_limiter = AsyncRateLimiter(**self.limiter_kwargs)
+        return AsyncDatabase(self.async_client, db, self.async_limiter)
+
+    async def aclose(self) -> None:
+        # an AsyncClient is bound to the event loop that uses it
+        if self.async_client is not None:
+            await self.async_client.aclose()
+            self.async_client = None
+            self.async_limiter = None
+
     def search_databases(self, title: str) -> List[Database]:
         """
         Search databases matching the given title.
@@ -27,11 +102,12 @@ class NotionService:
         cursor = None
         db_list = []
         while True:
-            res = self.client.search(query=title, start_cursor=cursor,
-                                     filter={'property': 'object',
-                                             'value': 'database'})
+            res = self.limiter.call(self.client.search,
+                                    query=title, start_cursor=cursor,
+                                    filter={'property': 'object',
+                                            'value': 'database'})
             for db_data in res.get('results'):
-                db_list.append(Database(self.client, db_data))
+                db_list.append(Database(self.client, db_data, self.limiter))
             if res['has_more']:
                 cursor = res['next_cursor']
             else:
@@ -69,6 +145,22 @@ class NotionService:
         self.fetch_databases()
         return self.db_map.get(db_name)
 
+    def get_database_by_id(self, db_id: str) -> Optional[Database]:
+        """
+        Retrieve the database of the given ID, or None if it is no longer
+        accessible. This is a pure wrapper of Notion APIs with no caching.
+        """
+        assert self.is_auth
+        try:
+            db_data = self.limiter.call(self.client.databases.retrieve,
+                                        database_id=db_id)
+        except APIResponseError as e:
+            if RateLimiter.is_retryable(e):
+                raise e
+            logging.info(f"Retrieve database {db_id} response: {e}")
+            return None
+        return Database(self.client, db_data, self.limiter)
+
     def use_database(self, db_name: str) -> None:
         self.active_db = self.get_database(db_name)
         assert self.active_db is not None
@@ -0,0 +1,186 @@
+"""
+Asyncio counterparts of RateLimiter, Database and PageWriter on top of
+notion_client's AsyncClient, so that many requests could be in flight on a
+single thread.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+from notion_client import AsyncClient
+from notion_client.errors import APIResponseError
+
+from local.metrics import metrics
+
+from .database import Database
+from .page import Page
+from .ratelimit import RateLimiter
+from .writer import PageWrite
+
+
+class AsyncRateLimiter(RateLimiter):
+    """The same policy as RateLimiter, for coroutines of one event loop."""
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        # created lazily, so that it binds to the running loop
+        self.async_cond = None
+
+    async def call(self, fn: Callable, *args: Any, idempotent: bool = True,
+                   **kwargs: Any) -> Any:
+        """Await `fn` under the rate limit, retrying as RateLimiter.call."""
+        endpoint = self.get_endpoint(fn)
+        attempt = 0
+        while True:
+            await self.acquire_async()
+            begin = time.perf_counter()
+            try:
+                res = await fn(*args, **kwargs)
+            except Exception as e:
+                metrics.observe(endpoint, time.perf_counter() - begin)
+                await self.release_async(backoff=self.is_retryable(e))
+                if not self.on_error(endpoint, e, attempt, idempotent):
+                    raise
+                delay = self.get_delay(e, attempt)
+                logging.warning("Notion request failed (%s); retry #%d in %.2fs",
+                                e, attempt + 1, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            metrics.observe(endpoint, time.perf_counter() - begin)
+            await self.release_async(backoff=False)
+            return res
+
+    async def acquire_async(self) -> None:
+        if self.async_cond is None:
+            self.async_cond = asyncio.Condition()
+        async with self.async_cond:
+            while True:
+                ok, timeout = self.try_acquire()
+                if ok:
+                    return
+                try:
+                    await asyncio.wait_for(self.async_cond.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release_async(self, *, backoff: bool) -> None:
+        async with self.async_cond:
+            self.on_release(backoff=backoff)
+            self.async_cond.notify_all()
+
+
+class AsyncDatabase:
+    """Send page requests of a Database through an AsyncClient."""
+
+    def __init__(self,
+                 client: AsyncClient,
+                 db: Database,
+                 limiter: AsyncRateLimiter) -> None:
+        self.client = client
+        self.db = db
+        self.id = db.id
+        self.limiter = limiter
+
+    async def create_page(self, page: Page) -> Page:
+        logging.info("Create page: %s", page)
+        return Page(await self.limiter.call(self.client.pages.create,
+                                            idempotent=False,
+                                            parent={'database_id': self.id},
+                                            properties=page.data))
+
+    async def update_page(self, page_id: str, page: Page) -> Page:
+        logging.info("Update page %s: %s", page_id, page)
+        return Page(await self.limiter.call(self.client.pages.update,
+                                            page_id=page_id,
+                                            properties=page.data))
+
+    async def delete_page(self, page_id: str,
+                          not_found_ok: bool = True) -> Optional[Page]:
+        try:
+            logging.info("Delete page %s", page_id)
+            return Page(await self.limiter.call(self.client.pages.update,
+                                                page_id=page_id,
+                                                archived=True))
+        except APIResponseError as e:
+            if not_found_ok and not AsyncRateLimiter.is_retryable(e):
+                logging.info("Delete page %s response: %s", page_id, e)
+                return None
+            raise e
+
+
+class AsyncPageWriter:
+    """
+    The same contract as PageWriter: writes are sent concurrently (as tasks
+    instead of threads) and reported through `on_done` in submission order.
+    """
+    CREATE = "create"
+    UPDATE = "update"
+    DELETE = "delete"
+
+    def __init__(self,
+                 db: AsyncDatabase,
+                 on_done: Callable[[str, str, Optional[Page], Optional[Exception]], None],
+                 *,
+                 max_pending: int = 64) -> None:
+        assert max_pending > 0
+        self.db = db
+        self.on_done = on_done
+        self.max_pending = max_pending
+        self.pending = deque()  # (op, key, task) in submission order
+        self.inflight = set()
+        self.num_failed = 0
+
+    async def __aenter__(self) -> 'AsyncPageWriter':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.flush()
+
+    async def submit(self, write: PageWrite) -> None:
+        if write.op == self.CREATE:
+            await self.create(write.key, write.page)
+        elif write.op == self.UPDATE:
+            await self.update(write.key, write.page_id, write.page)
+        else:
+            assert write.op == self.DELETE
+            await self.delete(write.key, write.page_id)
+
+    async def create(self, key: str, page: Page) -> None:
+        await self._submit(self.CREATE, key, self.db.create_page(page))
+
+    async def update(self, key: str, page_id: str, page: Page) -> None:
+        await self._submit(self.UPDATE, key,
+                           self.db.update_page(page_id, page))
+
+    async def delete(self, key: str, page_id: str) -> None:
+        await self._submit(self.DELETE, key, self.db.delete_page(page_id))
+
+    async def settle(self, key: str) -> None:
+        while key in self.inflight:
+            await self._complete_one()
+
+    async def flush(self) -> None:
+        while self.pending:
+            await self._complete_one()
+
+    async def _submit(self, op: str, key: str, coro: Awaitable[Any]) -> None:
+        await self.settle(key)
+        while len(self.pending) >= self.max_pending:
+            await self._complete_one()
+        self.pending.append((op, key, asyncio.ensure_future(coro)))
+        self.inflight.add(key)
+
+    async def _complete_one(self) -> None:
+        op, key, task = self.pending.popleft()
+        self.inflight.discard(key)
+        try:
+            with metrics.phase("write"):
+                result, error = await task, None
+        except Exception as e:
+            result, error = None, e
+            self.num_failed += 1
+            logging.error("Fail to %s page for %s: %s", op, key, e)
+        self.on_done(op, key, result, error)
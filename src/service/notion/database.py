@@ -1,21 +1,28 @@
-import dateutil.parser
-from typing import Dict, List, Any, Optional
+import datetime
+from typing import Dict, Iterator, List, Any, Optional
 from notion_client.errors import APIResponseError
 import pprint
 import logging
 
 from .column import Column
 from .page import Page
+from .ratelimit import RateLimiter
 
 
 class Database:
     def __init__(self,
                  service: 'NotionService',
-                 data: Dict) -> None:
+                 data: Dict,
+                 limiter: Optional[RateLimiter] = None) -> None:
         self.service = service
+        # shared by all databases of the same NotionService
+        self.limiter = limiter if limiter is not None else RateLimiter()
         self.id = data['id']
         self.title = data['title'][0]['plain_text']
-        self.created_time = dateutil.parser.isoparse(data['created_time'])
+        # e.g. "2022-01-01T00:00:00.000Z"; `fromisoformat` takes no "Z"
+        # before Python 3.11
+        self.created_time = datetime.datetime.fromisoformat(
+            data['created_time'].replace('Z', '+00:00'))
         self.data = data
         self.col_map = {k: Column(v) for k, v in data['properties'].items()}
 
@@ -35,26 +42,58 @@ class Database:
     def name(self) -> str:
         return self.title
 
+    def query(self, **body: Any) -> Dict:
+        # not wrapped by every version of notion_client, so send it directly
+        return self.service.request(path=f"databases/{self.id}/query",
+                                    method="POST", body=body)
+
+    def query_pages(self, filter: Optional[Dict] = None) -> Iterator[Page]:
+        """
+        Iterate over pages of the database (matching `filter` if given),
+        querying them page by page.
+        """
+        cursor = None
+        while True:
+            body = {'page_size': 100}
+            if filter is not None:
+                body['filter'] = filter
+            if cursor is not None:
+                body['start_cursor'] = cursor
+            res = self.limiter.call(self.query, **body)
+            for page_data in res['results']:
+                yield Page(page_data)
+            if not res['has_more']:
+                return
+            cursor = res['next_cursor']
+
     def retrieve_page(self, page_id: str) -> Page:
-        logging.info(f"Retrieve page {page_id}")
-        return Page(self.service.pages.retrieve(page_id=page_id))
+        logging.info("Retrieve page %s", page_id)
+        return Page(self.limiter.call(self.service.pages.retrieve,
+                                      page_id=page_id))
 
     def create_page(self, page: Page) -> Page:
-        logging.info(f"Create page: {page}")
-        return Page(self.service.pages.create(parent={'database_id': self.id},
-                                              properties=page.data))
+        logging.info("Create page: %s", page)
+        return Page(self.limiter.call(self.service.pages.create,
+                                      idempotent=False,
+                                      parent={'database_id': self.id},
+                                      properties=page.data))
 
     def update_page(self, page_id: str, page: Page) -> Page:
-        logging.info(f"Update page {page_id}: {page}")
-        return Page(self.service.pages.update(page_id=page_id, properties=page.data))
+        logging.info("Update page %s: %s", page_id, page)
+        return Page(self.limiter.call(self.service.pages.update,
+                                      page_id=page_id,
+                                      properties=page.data))
 
     def delete_page(self, page_id: str, not_found_ok: bool = True) -> Optional[Page]:
         try:
-            logging.info(f"Delete page {page_id}")
-            return Page(self.service.pages.update(page_id=page_id, archived=True))
+            logging.info("Delete page %s", page_id)
+            return Page(self.limiter.call(self.service.pages.update,
+                                          page_id=page_id,
+                                          archived=True))
         except APIResponseError as e:
-            if not_found_ok:
-                logging.info(f"Delete page {page_id} response: {e}")
+            # throttling that outlasts all retries is not a "not found"
+            if not_found_ok and not RateLimiter.is_retryable(e):
+                logging.info("Delete page %s response: %s", page_id, e)
                 return None
             # else: we are not expected to handle error here
             raise e
@@ -1,10 +1,45 @@
 import datetime
+import hashlib
+import json
 import logging
 import pprint
-from typing import List, Dict, Union, Optional
+from typing import Any, Callable, List, Dict, Union, Optional
 from .column import Column
 
 
+def parse_date(s: Optional[str]) -> Optional[Union[datetime.datetime, datetime.date]]:
+    if s is None:
+        return None
+    if 'T' not in s:
+        return datetime.date.fromisoformat(s)
+    # e.g. "2022-01-01T00:00:00.000Z"; `fromisoformat` takes no "Z" before
+    # Python 3.11
+    return datetime.datetime.fromisoformat(s.replace('Z', '+00:00'))
+
+
+def get_prop_value(prop: Optional[Dict]) -> Any:
+    """
+    Return the value of a property in a comparable form, whether the property
+    is as sent to Notion or as returned by it (which adds ids, annotations,
+    etc., and formats dates differently).
+    """
+    if prop is None:
+        return None
+    val = prop[prop['type']]
+    if prop['type'] in ('title', 'rich_text'):
+        return "".join(t['text']['content'] if 'text' in t
+                       else t.get('plain_text', '') for t in val)
+    if prop['type'] == 'select':
+        return val['name'] if val is not None else None
+    if prop['type'] == 'multi_select':
+        return sorted(o['name'] for o in val)
+    if prop['type'] == 'date':
+        if val is None:
+            return None
+        return parse_date(val['start']), parse_date(val.get('end'))
+    return val
+
+
 class Page:
     """Page is essentially a thin wrapper of a Dict"""
 
@@ -21,6 +56,31 @@ class Page:
     def __str__(self) -> str:
         return f"{self.id}: {pprint.pformat(self.data)}"
 
+    def fingerprint(self) -> Dict[str, str]:
+        """Return a short digest of each property."""
+        return {k: hashlib.blake2b(
+                    json.dumps(v, sort_keys=True).encode('utf-8'),
+                    digest_size=8).hexdigest()
+                for k, v in self.data.items()}
+
+    def is_same_as(self, page: 'Page') -> bool:
+        """
+        Return whether a page retrieved from Notion has the same values of
+        all properties of this (built) page.
+        """
+        props = page.data.get('properties', {})
+        return all(get_prop_value(v) == get_prop_value(props.get(k))
+                   for k, v in self.data.items())
+
+    def diff(self, fingerprint: Dict[str, str]) -> 'Page':
+        """
+        Return a page with only the properties whose digest differs from the
+        given fingerprint (e.g. the one of the last pushed page).
+        """
+        return Page({k: self.data[k]
+                     for k, v in self.fingerprint().items()
+                     if fingerprint.get(k) != v})
+
 
 class PageBuilder:
     def __init__(self) -> None:
@@ -35,23 +95,34 @@ class PageBuilder:
     def add_column(self, col: Column, col_val: str):
         # add based on col's type
         # date/time must be added explicitly throughput add_date
+        self.page[col.name] = self.get_serializer(col)(col_val)
+
+    @classmethod
+    def get_serializer(cls, col: Column) -> Callable[[str], Dict]:
+        """
+        Return the function that turns a value into a property of the column,
+        so that the dispatch on its type (and the set of its options) is done
+        once for all values of the column.
+        """
         if col.type == "title":
-            self.add_title(col.name, col_val)
-        elif col.type == "rich_text":
-            self.add_text(col.name, col_val)
-        elif col.type == "multi_select":
-            if col_val not in col.options:
-                logging.warning(f"multi_select option not found: {col_val}")
-            self.add_multi_select(col.name, col_val)
-        elif col.type == "select":
-            self.add_select(col.name, col_val)
-            if col_val not in col.options:
-                logging.warning(f"select option not found: {col_val}")
-        else:
-            raise ValueError("Column type not supported")
+            return cls.get_title
+        if col.type == "rich_text":
+            return cls.get_text
+        if col.type == "multi_select" or col.type == "select":
+            get_prop = (cls.get_multi_select if col.type == "multi_select"
+                        else cls.get_select)
+            options = frozenset(col.options)
 
-    def add_title(self, col_key: str, col_val: str):
-        self.page[col_key] = {
+            def serialize(col_val: str) -> Dict:
+                if col_val not in options:
+                    logging.warning(f"{col.type} option not found: {col_val}")
+                return get_prop(col_val)
+            return serialize
+        raise ValueError("Column type not supported")
+
+    @staticmethod
+    def get_title(col_val: str) -> Dict:
+        return {
             "type": "title",
             "title": [{
                 "type": "text",
@@ -61,11 +132,12 @@ class PageBuilder:
             }]
         }
 
-    def add_text(self, col_key: str, col_val: str):
+    @staticmethod
+    def get_text(col_val: str) -> Dict:
         if len(col_val) > 2000:
             logging.warning("Notion APIs have size limits for the content (<=2000); will truncate the text to fit the limits")
             col_val = col_val[: 2000]
-        self.page[col_key] = {
+        return {
             "type": "rich_text",
             "rich_text": [{
                 "type": "text",
@@ -75,23 +147,38 @@ class PageBuilder:
             }]
         }
 
-    def add_multi_select(self, col_key: str, col_val: List[str]):
-        self.page[col_key] = {
+    @staticmethod
+    def get_multi_select(col_val: List[str]) -> Dict:
+        return {
             "type": "multi_select",
             "multi_select": [{"name": v} for v in col_val]
         }
 
+    @staticmethod
+    def get_select(col_val: str) -> Dict:
+        return {"type": "select", "select": {"name": col_val}}
+
+    @staticmethod
+    def get_date(begin: Union[datetime.datetime, datetime.date],
+                 end: Optional[Union[datetime.datetime, datetime.date]] = None) -> Dict:
+        date = {"start": begin.isoformat()}
+        if end is not None:
+            date["end"] = end.isoformat()
+        return {"type": "date", "date": date}
+
+    def add_title(self, col_key: str, col_val: str):
+        self.page[col_key] = self.get_title(col_val)
+
+    def add_text(self, col_key: str, col_val: str):
+        self.page[col_key] = self.get_text(col_val)
+
+    def add_multi_select(self, col_key: str, col_val: List[str]):
+        self.page[col_key] = self.get_multi_select(col_val)
+
     def add_select(self, col_key: str, col_val: str):
-        self.page[col_key] = {"type": "select", "select": {"name": col_val}}
+        self.page[col_key] = self.get_select(col_val)
 
     def add_date(self, col_key: str,
                  begin: Union[datetime.datetime, datetime.date],
                  end: Optional[Union[datetime.datetime, datetime.date]] = None):
-        self.page[col_key] = {
-            "type": "date",
-            "date": {
-                "start": begin.isoformat()
-            }
-        }
-        if end is not None:
-            self.page[col_key]["date"]["end"] = end.isoformat()
+        self.page[col_key] = self.get_date(begin, end)
@@ -0,0 +1,194 @@
+"""
+Throttle and retry requests to Notion.
+
+Notion allows an average of 3 requests per second per integration and answers
+HTTP 429 (with a `Retry-After` header) beyond that; it may also answer 5xx
+under load. All requests of a NotionService go through one RateLimiter.
+
+A request that is not idempotent (i.e. creating a page) is only retried if
+it surely has not taken effect: when throttled, or when it could not be sent
+at all. Otherwise, a page stored by Notion whose response is lost (e.g. a
+read timeout or a 502 from a gateway) would be created twice; the failure is
+left to the caller, which could find out later whether it took effect.
+"""
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Optional, Tuple
+
+import httpx
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
+
+from local.metrics import metrics
+
+
+class RateLimiter:
+    """
+    A token bucket for the request rate, plus an AIMD window for the number of
+    requests in flight: the window grows by one per window of successful
+    requests, and halves whenever the servers push back.
+    """
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+    # raised before a request is sent, so it is safe to retry any request
+    UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout,
+                     httpx.PoolTimeout)
+
+    def __init__(self,
+                 *,
+                 rate: float = 3.0,
+                 burst: int = 3,
+                 max_concurrency: int = 8,
+                 min_concurrency: int = 1,
+                 max_retries: int = 8,
+                 base_delay: float = 0.5,
+                 max_delay: float = 60.0) -> None:
+        assert rate > 0 and burst >= 1
+        assert 1 <= min_concurrency <= max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.cond = threading.Condition()
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.concurrency = float(max_concurrency)
+        self.inflight = 0
+        # no request is sent before this time (set by `Retry-After`)
+        self.paused_until = 0.0
+
+    @classmethod
+    def is_retryable(cls, e: Exception, idempotent: bool = True) -> bool:
+        if isinstance(e, HTTPResponseError):
+            if not idempotent:
+                return e.status == 429
+            return e.status in cls.RETRY_STATUS
+        if isinstance(e, RequestTimeoutError):
+            if idempotent:
+                return True
+            # notion_client raises it while handling httpx's timeout
+            e = e.__context__
+        if not idempotent:
+            return isinstance(e, cls.UNSENT_ERRORS)
+        return isinstance(e, httpx.TransportError)
+
+    @staticmethod
+    def get_endpoint(fn: Callable) -> str:
+        """Name an endpoint of notion_client, e.g. "notion.pages.create"."""
+        name = getattr(fn, '__qualname__', None) or type(fn).__qualname__
+        return f"notion.{name.replace('Endpoint', '').lower()}"
+
+    def on_error(self, endpoint: str, e: Exception, attempt: int,
+                 idempotent: bool = True) -> bool:
+        """Count a failed attempt; return whether to retry it."""
+        if isinstance(e, HTTPResponseError) and e.status == 429:
+            metrics.count(endpoint, "throttled")
+        if not self.is_retryable(e, idempotent) or attempt >= self.max_retries:
+            metrics.count(endpoint, "errors")
+            return False
+        metrics.count(endpoint, "retries")
+        return True
+
+    @staticmethod
+    def get_retry_after(e: Exception) -> Optional[float]:
+        headers = getattr(e, 'headers', None)
+        if headers is None:
+            return None
+        val = headers.get('retry-after')
+        if val is None:
+            return None
+        try:
+            return max(float(val), 0.0)
+        except ValueError:  # could also be an HTTP-date; not used by Notion
+            return None
+
+    def call(self, fn: Callable, *args: Any, idempotent: bool = True,
+             **kwargs: Any) -> Any:
+        """
+        Call `fn` under the rate limit, retrying on throttling or 5xx (only on
+        throttling or unsent requests if not `idempotent`).
+        """
+        endpoint = self.get_endpoint(fn)
+        attempt = 0
+        while True:
+            self.acquire()
+            begin = time.perf_counter()
+            try:
+                res = fn(*args, **kwargs)
+            except Exception as e:
+                metrics.observe(endpoint, time.perf_counter() - begin)
+                # the servers push back, whether or not it is retried
+                self.release(backoff=self.is_retryable(e))
+                if not self.on_error(endpoint, e, attempt, idempotent):
+                    raise
+                delay = self.get_delay(e, attempt)
+                logging.warning("Notion request failed (%s); retry #%d in %.2fs",
+                                e, attempt + 1, delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            metrics.observe(endpoint, time.perf_counter() - begin)
+            self.release(backoff=False)
+            return res
+
+    def get_delay(self, e: Exception, attempt: int) -> float:
+        # "full jitter" exponential backoff
+        delay = random.uniform(
+            0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = self.get_retry_after(e)
+        if retry_after is not None:
+            # the servers ask all of us to wait, not only this request
+            delay = retry_after + random.uniform(0, self.base_delay)
+            with self.cond:
+                self.paused_until = max(self.paused_until,
+                                        time.monotonic() + retry_after)
+        return delay
+
+    def try_acquire(self) -> Tuple[bool, Optional[float]]:
+        """
+        Take a token and an in-flight slot if both are available. Otherwise,
+        return how long to wait before retrying (None if until a release).
+        Must be called with the lock held.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+        if now < self.paused_until:
+            return False, self.paused_until - now
+        if self.inflight >= int(self.concurrency):
+            return False, None
+        if self.tokens < 1:
+            return False, (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        self.inflight += 1
+        return True, None
+
+    def on_release(self, *, backoff: bool) -> None:
+        """Must be called with the lock held."""
+        self.inflight -= 1
+        if backoff:
+            self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            logging.info("Reduce Notion concurrency to %d",
+                         int(self.concurrency))
+        else:
+            self.concurrency = min(self.max_concurrency,
+                                   self.concurrency + 1 / self.concurrency)
+
+    def acquire(self) -> None:
+        with self.cond:
+            while True:
+                ok, timeout = self.try_acquire()
+                if ok:
+                    return
+                self.cond.wait(timeout)
+
+    def release(self, *, backoff: bool) -> None:
+        with self.cond:
+            self.on_release(backoff=backoff)
+            self.cond.notify_all()
+
@@ -0,0 +1,116 @@
+"""
+Send page writes to a Notion database through a bounded pool of threads.
+"""
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, NamedTuple, Optional
+
+from local.metrics import metrics
+
+from .database import Database
+from .page import Page
+
+
+class PageWrite(NamedTuple):
+    """A planned write: `page_id` is None for CREATE; `page` is None for DELETE."""
+    op: str
+    key: str
+    page_id: Optional[str]
+    page: Optional[Page]
+
+
+class PageWriter:
+    """
+    Issue create/update/delete requests of pages concurrently.
+
+    Completions are reported through `on_done(op, key, result, error)` in the
+    same order as the writes were submitted, and always from the submitting
+    thread, so the caller could keep its local state (e.g. a DurableMap, which
+    is not thread-safe) updated deterministically.
+    A key never has more than one write in flight: before planning a new write
+    for a key, call `settle(key)` so that the previous one has been reported.
+    """
+    CREATE = "create"
+    UPDATE = "update"
+    DELETE = "delete"
+
+    def __init__(self,
+                 db: Database,
+                 on_done: Callable[[str, str, Optional[Page], Optional[Exception]], None],
+                 *,
+                 max_workers: int = 4,
+                 max_pending: Optional[int] = None) -> None:
+        assert max_workers > 0
+        self.db = db
+        self.on_done = on_done
+        # bound the number of submitted-but-not-reported writes, so that a huge
+        # sync won't queue up all its pages in memory
+        self.max_pending = max_pending if max_pending is not None \
+            else 4 * max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="notion-writer")
+        self.pending = deque()  # (op, key, future) in submission order
+        self.inflight = set()  # keys with a write in `pending`
+        self.num_failed = 0
+
+    def __enter__(self) -> 'PageWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def submit(self, write: PageWrite) -> None:
+        if write.op == self.CREATE:
+            self.create(write.key, write.page)
+        elif write.op == self.UPDATE:
+            self.update(write.key, write.page_id, write.page)
+        else:
+            assert write.op == self.DELETE
+            self.delete(write.key, write.page_id)
+
+    def create(self, key: str, page: Page) -> None:
+        self._submit(self.CREATE, key, self.db.create_page, page)
+
+    def update(self, key: str, page_id: str, page: Page) -> None:
+        self._submit(self.UPDATE, key, self.db.update_page, page_id, page)
+
+    def delete(self, key: str, page_id: str) -> None:
+        self._submit(self.DELETE, key, self.db.delete_page, page_id)
+
+    def settle(self, key: str) -> None:
+        """Wait until the write of the given key (if any) has been reported."""
+        while key in self.inflight:
+            self._complete_one()
+
+    def flush(self) -> None:
+        """Wait until all submitted writes have been reported."""
+        while self.pending:
+            self._complete_one()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def _submit(self, op: str, key: str, fn: Callable, *args: Any) -> None:
+        self.settle(key)
+        while len(self.pending) >= self.max_pending:
+            self._complete_one()
+        future = self.executor.submit(fn, *args)
+        self.pending.append((op, key, future))
+        self.inflight.add(key)
+
+    def _complete_one(self) -> None:
+        op, key, future = self.pending.popleft()
+        self.inflight.discard(key)
+        try:
+            # time that the caller waits for Notion
+            with metrics.phase("write"):
+                result, error = future.result(), None
+        except Exception as e:
+            result, error = None, e
+            self.num_failed += 1
+            logging.error("Fail to %s page for %s: %s", op, key, e)
+        self.on_done(op, key, result, error)
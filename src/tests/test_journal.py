@@ -0,0 +1,137 @@
+"""
+Recovering in-doubt page creates from the journal of an interrupted
+synchronization.
+
+    cd src && python -m unittest discover tests
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+# must be set before importing gcal_notion, which reads it
+os.environ.setdefault("SNOW_HOME", tempfile.mkdtemp(prefix="snow-test-"))
+import gcal_notion as app  # noqa: E402
+from local.data import DurableStore  # noqa: E402
+from service.notion.column import Column  # noqa: E402
+from service.notion.page import Page, PageBuilder  # noqa: E402
+from service.notion.writer import PageWrite, PageWriter  # noqa: E402
+
+TITLE_COL = Column({"name": "Name", "type": "title"})
+TIME_COL = Column({"name": "Date", "type": "date"})
+TZ = datetime.timezone(datetime.timedelta(hours=-4))
+
+
+class FakeConfig:
+    def __init__(self, values) -> None:
+        self.values = values
+
+    def get_parsed_val(self, name):
+        return self.values[name]
+
+
+class FakeDatabase:
+    """Answer every query with the given pages (Notion filters by title)."""
+
+    def __init__(self, pages) -> None:
+        self.pages = pages
+
+    def query_pages(self, filter=None):
+        return iter(self.pages)
+
+
+def get_start(day: int) -> datetime.datetime:
+    return datetime.datetime(2026, 10, day, 10, tzinfo=TZ)
+
+
+def build_page(day: int) -> Page:
+    pb = PageBuilder()
+    pb.add_title(TITLE_COL.name, "Standup")
+    pb.add_date(TIME_COL.name, get_start(day),
+                get_start(day) + datetime.timedelta(minutes=15))
+    return pb.build()
+
+
+def get_notion_page(page_id: str, day: int) -> Page:
+    """Return a page as Notion returns it, with the properties of `day`."""
+    start = get_start(day)
+    end = start + datetime.timedelta(minutes=15)
+    return Page({
+        "id": page_id,
+        "created_time": "2026-10-18T12:00:00.000Z",
+        "properties": {
+            TITLE_COL.name: {"id": "title", "type": "title", "title": [
+                {"type": "text", "plain_text": "Standup",
+                 "text": {"content": "Standup", "link": None}}]},
+            TIME_COL.name: {"id": "d", "type": "date", "date": {
+                "start": start.isoformat(timespec="milliseconds"),
+                "end": end.isoformat(timespec="milliseconds"),
+                "time_zone": None}}}})
+
+
+class ReplayJournalTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp(prefix="snow-test-")
+        self.store = DurableStore(os.path.join(self.dir, "test.db"))
+        self.cal = SimpleNamespace(id="cal", name="Calendar")
+        self.id_map = app.get_id_map(self.store, self.cal)
+        self.prop_map = app.get_prop_map(self.store, self.cal)
+        self.journal = app.get_journal(self.store, self.cal)
+
+    def tearDown(self) -> None:
+        self.store.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def log_create(self, config: FakeConfig, eid: str, day: int) -> None:
+        page = build_page(day)
+        app.log_write(config, self.journal,
+                      PageWrite(PageWriter.CREATE, eid, None, page),
+                      {eid: page.fingerprint()})
+
+    def replay(self, pages) -> None:
+        app.replay_journal(self.cal, FakeDatabase(pages), self.journal,
+                           self.id_map, self.prop_map)
+
+    def test_skip_mapped_page_of_same_title(self) -> None:
+        config = FakeConfig({"event_id_col": None, "field_col_map": {
+            "title": TITLE_COL, "time": TIME_COL}})
+        self.id_map.put("standup_20261018", "page-B")
+        self.log_create(config, "standup_20261019", 19)
+        self.replay([get_notion_page("page-B", 18)])
+        self.assertIsNone(self.id_map.get("standup_20261019"))
+        self.assertEqual(self.journal.items(), [])
+
+    def test_adopt_page_of_same_time(self) -> None:
+        config = FakeConfig({"event_id_col": None, "field_col_map": {
+            "title": TITLE_COL, "time": TIME_COL}})
+        self.log_create(config, "standup_20261019", 19)
+        self.replay([get_notion_page("page-B", 18),
+                     get_notion_page("page-C", 19)])
+        self.assertEqual(self.id_map.get("standup_20261019"), "page-C")
+        self.assertIsNotNone(self.prop_map.get("standup_20261019"))
+
+    def test_skip_page_of_replayed_create(self) -> None:
+        # no time column: pages could only be told apart by the title
+        config = FakeConfig({"event_id_col": None,
+                             "field_col_map": {"title": TITLE_COL}})
+        self.log_create(config, "standup_20261018", 18)
+        self.journal.mark_done("standup_20261018", {
+            "op": PageWriter.CREATE, "page_id": "page-B", "fingerprint": {}})
+        self.log_create(config, "standup_20261019", 19)
+        self.replay([get_notion_page("page-B", 18)])
+        self.assertEqual(self.id_map.get("standup_20261018"), "page-B")
+        self.assertIsNone(self.id_map.get("standup_20261019"))
+
+    def test_skip_ambiguous_title(self) -> None:
+        config = FakeConfig({"event_id_col": None,
+                             "field_col_map": {"title": TITLE_COL}})
+        self.log_create(config, "standup_20261019", 19)
+        self.replay([get_notion_page("page-B", 18),
+                     get_notion_page("page-C", 19)])
+        self.assertIsNone(self.id_map.get("standup_20261019"))
+
+
+if __name__ == "__main__":
+    unittest.main()